@@ -8,29 +8,157 @@
 #==============================================================================
 
 # Libraries
+import threading
+
 import pandas as pd
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx, add_script_run_ctx
 import folium
 from streamlit_folium import st_folium
-import geopandas as gpd
-import branca.colormap as cm
 import plotly.express as px
 import plotly.graph_objs as go
-from datetime import datetime
+
+import risk_data
+import risk_maps as rm
+import risk_tiles
+import risk_profile
+import risk_artifacts as ra
+import risk_raster as rr
+import choropleth_component as cc
 
 
 st.set_page_config(layout="wide") 
 
+# Frames derived from the shared data share its buffers until they are
+# written to, and are then copied: no view can change the data of others
+pd.set_option('mode.copy_on_write', True)
+
+
+# Profile of the rerun: loaders and render stages are timed, logged to
+# risk_profile.PROFILE_LOG and shown in a debug panel with ?debug=1
+ctx = get_script_run_ctx()
+profiler = risk_profile.Profiler(session=ctx.session_id if ctx else None)
+profiler.watch_messages(ctx)
+
+
+# Fingerprints of the data sources: the caches derived from a source take
+# its fingerprint, so that an updated file is read again without a restart
+sources = risk_data.source_fingerprints()
+
+
+# Data shared by every session of the process, without a copy per call;
+# the previous version of a source is kept while sessions move to the new one.
+# The sources being loaded together, under a single spinner, the loaders
+# show none.
+shared_data = st.cache_resource(max_entries=2, show_spinner=False)
+
+# Sources missing or without the columns their loader reads, checked from
+# their headers before anything is read: the views reading them show the
+# problem instead of failing halfway
+@profiler.cached(shared_data)
+def source_problems(version):
+    return risk_data.check_sources()
+
+sources_version = tuple(sources.values())
+problems = source_problems(sources_version)
+
+# Sources of the views
+RISK_SOURCES = ['insee', *risk_data.PREDICTION_CSVS, 'historical']
+EVENT_SOURCES = [f'{name}_events' for name in risk_data.EVENT_CSVS]
+
+def source_errors(names):
+    """
+    This function shows the problems of the given sources, and tells whether
+    there is any
+    """
+    found = [name for name in names if name in problems]
+    for name in found:
+        st.error(f"Source indisponible : {risk_data.SOURCES[name]} ({problems[name]})")
+    return bool(found)
+
+# Every view needs the communes
+if source_errors(['insee']):
+    st.stop()
 
 # Load data
-inseedf = pd.read_csv('insee_df.csv')
-inseedf['geometry'] = gpd.GeoSeries.from_wkt(inseedf['geometry'])
-inseedf['Code INSEE'] = inseedf['Code INSEE'].astype(str).str.strip()
+@profiler.cached(shared_data)
+def load_insee(version):
+    return risk_data.load_communes()
+
+# Cached function for tab1  
+@profiler.cached(shared_data)
+def tab1_cache(version):
+    return risk_data.load_predictions(risk_data.PREDICTION_CSVS['coul'])
+
+@profiler.cached(shared_data)
+def tab2_cache(version):
+    return risk_data.load_predictions(risk_data.PREDICTION_CSVS['rem'])
+
+@profiler.cached(shared_data)
+def tab3_cache(version):
+    return risk_data.load_predictions(risk_data.PREDICTION_CSVS['sech'])
+    
+@profiler.cached(shared_data)
+def load_historical(version):
+    return risk_data.load_historical()
+
+# Event store kept in step with the event CSVs and shared by every session:
+# one table sorted by peril and date, whose views are slices of it. Arrêtés
+# appended to a CSV are merged into the events, totals and aggregates
+# without reloading it. Its commune codes share the dtype of the communes,
+# one store being kept per version of the commune CSV
+@profiler.cached(shared_data)
+def event_store(version):
+    return risk_data.event_store(load_insee(version))
+
+# Soil map page read once per version of sol_map.html and written to the
+# static files of the choropleth component, under a content-hashed name: the
+# dashboard serves it compressed and with an ETag, and only its URL is sent
+@profiler.cached(shared_data)
+def soil_map(version):
+    return cc.page_url('soil', risk_data.load_soil_map())
+
+@profiler.profiled
+def refresh_events():
+    return event_store(sources['insee']).refresh()
+
+# Every valid source is read concurrently on the first run of the process,
+# and again once one of them changed, so that a cold start takes as long as
+# the slowest file rather than the sum of them. The loader threads run in the
+# context of the script run, for the caches; a loader failing here fails
+# again in the views reading it.
+SOURCE_LOADERS = {
+    'insee': (['insee'], lambda: load_insee(sources['insee'])),
+    'coul': (['coul'], lambda: tab1_cache(sources['coul'])),
+    'rem': (['rem'], lambda: tab2_cache(sources['rem'])),
+    'sech': (['sech'], lambda: tab3_cache(sources['sech'])),
+    'historical': (['historical'], lambda: load_historical(sources['historical'])),
+    'events': (EVENT_SOURCES, refresh_events),
+    'soil': (['soil'], lambda: soil_map(sources['soil'])),
+}
+
+# Version of the sources last loaded by the process: the other reruns skip
+# the load, its threads and its spinner, and sessions starting together wait
+# for the one loading the sources
+@st.cache_resource(show_spinner=False)
+def loaded_sources():
+    return {'version': None, 'lock': threading.Lock()}
+
+loaded = loaded_sources()
+if loaded['version'] != sources_version:
+    with profiler.stage('load_sources') as stage, st.spinner("Chargement des données..."), loaded['lock']:
+        if loaded['version'] != sources_version:
+            risk_data.load_concurrently({name: profiler.nested(stage, loader) for name, (names, loader) in SOURCE_LOADERS.items()
+                                         if not set(names) & set(problems)}, initializer=lambda: add_script_run_ctx(ctx=ctx))
+            loaded['version'] = sources_version
+
+inseedf = load_insee(sources['insee'])
 
 
 #==============================================================================
 # Header
 #==============================================================================
+@profiler.profiled
 def render_header():
     """
     This function render the header of the dashboard with the following items:
@@ -45,500 +173,540 @@ def render_header():
     with col2:
         st.title("PréviRisque - Nord Pas De Calais")
         
-# Cached function for tab1  
-@st.cache_data
-def tab1_cache():
-    existing_df = pd.read_csv('coul_predictions.csv')
-    existing_df['Code INSEE'] = existing_df['Code INSEE'].astype(str).str.strip()
-    return existing_df
-
-@st.cache_data
-def tab2_cache():
-    existing_df = pd.read_csv('rem_predictions.csv')
-    existing_df['Code INSEE'] = existing_df['Code INSEE'].astype(str).str.strip()
-    return existing_df
-
-@st.cache_data
-def tab3_cache():
-    existing_df = pd.read_csv('sech_predictions.csv')
-    existing_df['Code INSEE'] = existing_df['Code INSEE'].astype(str).str.strip()
-    return existing_df
-    
-@st.cache_data
-def load_historical():
-    historical_risk_path = 'historical_risk.csv'
-    historical_risk = pd.read_csv(historical_risk_path)
-    historical_risk['Code INSEE'] = historical_risk['Code INSEE'].astype(str).str.strip()
-    historical_risk = historical_risk.groupby('Code INSEE').first().reset_index()
-    historical_risk['normalized_historical_risk_score'] = historical_risk['normalized_historical_risk_score'].round(4)
-    return historical_risk
-
-@st.cache_data
-def inon_events():
-    events_df = pd.read_csv('inon_events.csv')
-    events_df['dat_deb'] = pd.to_datetime(events_df['dat_deb'])
-    events_df['dat_fin'] = pd.to_datetime(events_df['dat_fin'])
-    events_df['duration'] = (events_df['dat_fin'] - events_df['dat_deb']).dt.days + 1
-    return events_df
-
-@st.cache_data
-def sech_events():
-    events_df = pd.read_csv('sech_events.csv')
-    events_df['dat_deb'] = pd.to_datetime(events_df['dat_deb'])
-    events_df['dat_fin'] = pd.to_datetime(events_df['dat_fin'])
-    events_df['duration'] = (events_df['dat_fin'] - events_df['dat_deb']).dt.days + 1
-    return events_df
-
-@st.cache_data
-def cat_events():
-    events_df = pd.read_csv('cat_events.csv')
-    events_df['dat_deb'] = pd.to_datetime(events_df['dat_deb'])
-    return events_df
-
-
 #==============================================================================
-# Tab 1
+# Navigation
 #==============================================================================
-# Function to get the column for the selected year
-def get_selected_column(prefix, selected_year):
-    return f"{prefix}{selected_year}"
+# Navigation modes: every view in st.tabs, or only the selected view computed
+TABS_MODE = "Onglets"
+LAZY_MODE = "Vue active uniquement"
+NAVIGATION_MODES = [LAZY_MODE, TABS_MODE]
 
-def render_tab1():
+def render_views(views, key):
     """
-    This function renders Tab 1 - Map of risks at INSEE level
+    This function renders a set of views given as (label, render function)
+    pairs. In the lazy mode the selected view is kept in the query parameters
+    and the other views are not computed at all.
     """
-    
-    existing_df1 = tab1_cache()
-    existing_df2 = tab2_cache()
-    existing_df3 = tab3_cache()
-    historical_risk = load_historical()
+    labels = [label for label, _ in views]
 
-    # Identify the year columns
-    year_columns = [col for col in existing_df1.columns if col.startswith('event_intensity_coul_')]
-    year_options = [col.split('_')[-1] for col in year_columns]
+    if navigation_mode == TABS_MODE:
+        for tab, (_, render) in zip(st.tabs(labels), views):
+            with tab:
+                render()
+        return
 
-    # Create a select box for the year selection
-    selected_year = st.selectbox("Sélectionnez l'année:", options=year_options, key="select_year1")
+    selected = st.query_params.get(key, labels[0])
+    selected = st.radio(key, options=labels, index=labels.index(selected) if selected in labels else 0,
+                        horizontal=True, key=key, label_visibility="collapsed")
+    st.query_params[key] = selected
+    dict(views)[selected]()
 
-   # Merge the dataframes with inseedf to get 'Commune' and 'geometry'
-    df1 = inseedf.merge(existing_df1[['Code INSEE', get_selected_column('event_intensity_coul_', selected_year)]], on='Code INSEE').rename(columns={get_selected_column('event_intensity_coul_', selected_year): 'risk_coul'})
-    df2 = inseedf.merge(existing_df2[['Code INSEE', get_selected_column('event_intensity_rem_', selected_year)]], on='Code INSEE').rename(columns={get_selected_column('event_intensity_rem_', selected_year): 'risk_rem'})
-    df3 = inseedf.merge(existing_df3[['Code INSEE', get_selected_column('event_intensity_sech_', selected_year)]], on='Code INSEE').rename(columns={get_selected_column('event_intensity_sech_', selected_year): 'risk_sech'})
-    
-    # Round the risk scores
-    df1['risk_coul'] = df1['risk_coul'].round(4)
-    df2['risk_rem'] = df2['risk_rem'].round(4)
-    df3['risk_sech'] = df3['risk_sech'].round(4)
-    
-    # Merge the historical risk data
-    df_combined = df1.merge(df2[['Code INSEE', 'risk_rem']], on='Code INSEE').merge(df3[['Code INSEE', 'risk_sech']], on='Code INSEE').merge(historical_risk[['Code INSEE', 'normalized_historical_risk_score']], on='Code INSEE')
+# Perils of the event maps
+EVENT_PERILS = ['inon', 'sech']
 
-    # Create a GeoDataFrame
-    gdf = gpd.GeoDataFrame(df_combined, geometry='geometry')
-    
-    gdf['average_risk'] = gdf[['risk_coul', 'risk_rem', 'risk_sech', 'normalized_historical_risk_score']].mean(axis=1).round(4)
+# Fingerprints of the event CSVs
+event_version = tuple(sources[name] for name in EVENT_SOURCES)
 
-    # Create colormap
-    colormap = cm.LinearColormap(colors=['#FFFFB2','#FFD700', '#FFC300','#FFB000', '#FF8C00', '#FF7000', '#FF4500', '#FF2400', '#FF0000', '#CC0000','#8B0000'], vmin=gdf['average_risk'].min(), vmax=gdf['average_risk'].max())
+# Event aggregates, keyed by peril
+@profiler.profiled
+def event_aggregates(peril):
+    return event_store(sources['insee']).refresh()['aggregates'][peril]
 
-    commune_names = [''] + gdf['Commune'].unique().tolist() 
-    selected_commune = st.selectbox("Entrez le nom de la commune:", options=commune_names, key="select_commune1", index=0)
-    
-    # Create a Folium map
-    m = folium.Map(location=[50.6292, 3.0573], zoom_start=8)  
-    
-    selected_geom = None
-    selected_geojson = None
+@profiler.profiled
+def catnat_counts():
+    return event_store(sources['insee']).refresh()['aggregates']['cat']
 
-    for _, row in gdf.iterrows():
+#==============================================================================
+# Maps
+#==============================================================================
+# Map modes: a full Folium map on every rerun, a geometry layer sent once
+# per session and restyled on later reruns, vector tiles loaded in view,
+# a map pre-rendered by risk_artifacts.py served from the disk cache, or a
+# single image of the communes colored from their commune-ID grid
+FOLIUM_MODE = "Carte complète"
+STYLE_MODE = "Mise à jour des couleurs"
+TILE_MODE = "Tuiles vectorielles"
+ARTIFACT_MODE = "Carte pré-rendue"
+RASTER_MODE = "Image matricielle"
+MAP_MODES = [FOLIUM_MODE, STYLE_MODE, TILE_MODE, ARTIFACT_MODE, RASTER_MODE]
+
+# Feature properties sent once with the geometry
+STATIC_FIELDS = ['Code INSEE', 'Commune']
+
+# Geometry pyramid: simplified communes and rollups, one level per zoom range.
+# As the communes, the pyramid, its files and the indexes below are kept for
+# the current and previous versions of the commune CSV only.
+@profiler.cached(shared_data)
+def geometry_pyramid(version):
+    return risk_data.load_pyramid(load_insee(version))
+
+@profiler.cached(shared_data)
+def commune_geometry(version):
+    return cc.pyramid_files(load_insee(version), geometry_pyramid(version), STATIC_FIELDS)
+
+# Vector tiles of every year and peril, keyed by the fingerprints of the
+# risk sources, the communes among them, and of the event sources. They are
+# written to the choropleth component, which serves them. As on disk, only
+# the current and previous tilesets are kept. The columns of invalid sources
+# are left out, their views showing the problem instead.
+@profiler.cached(st.cache_resource(max_entries=risk_tiles.TILESET_KEEP))
+def commune_tiles(risk_version, event_version):
+    frames = {}
+    if not any(name in problems for name in RISK_SOURCES):
+        cube = risk_cube(risk_version)
+        frames.update({year: risk_frame(cube, year_index)[RISK_FIELDS] for year_index, year in enumerate(cube['years'])})
+    if not any(name in problems for name in EVENT_SOURCES):
+        frames.update({peril: event_frame(peril)[EVENT_FIELDS] for peril in EVENT_PERILS})
+    attributes = risk_tiles.tile_attributes(inseedf[STATIC_FIELDS], frames)
+    return risk_tiles.build_tiles(attributes, geometry_pyramid(sources['insee']), cc.TILES_DIR)
+
+# Disk cache of the pre-rendered maps; a map missing from it is rendered
+# and added on first use
+@profiler.cached(st.cache_resource)
+def artifact_cache():
+    return ra.ArtifactCache()
+
+# Commune-ID grid of the raster maps, aligned to inseedf
+@profiler.cached(shared_data)
+def commune_raster(version):
+    return risk_data.freeze(rr.load_raster(load_insee(version)))
+
+# Spatial and search index of the communes, aligned to inseedf
+@profiler.cached(shared_data)
+def commune_index(version):
+    return risk_data.freeze(risk_data.build_commune_index(load_insee(version)))
+
+# Size of the Folium maps, in pixels
+MAP_WIDTH = 1600
+MAP_HEIGHT = 600
+
+def clicked_commune(key, click, raster=None):
+    """
+    This function returns the commune under a new map click, read from the
+    commune-ID grid of a raster map, None when the click was already handled
+    or is outside every commune
+    """
+    if not click or click == st.session_state.get(f"{key}_clicked"):
+        return None
+    st.session_state[f"{key}_clicked"] = click
+    if raster is not None:
+        return rr.raster_lookup(raster, click['lng'], click['lat'])
+    return risk_data.locate_commune(commune_index(sources['insee']), click['lng'], click['lat'])
+
+@profiler.profiled
+def render_map(gdf, value_column, colormap, fields, aliases, key, variant, fill_opacity=0.8, selected=None, footer=None):
+    """
+    This function displays a choropleth of a GeoDataFrame aligned with inseedf
+    in the selected map mode, at the level of the geometry pyramid matching the
+    zoom. Communes with a missing value are not shown.
+
+    The variant (a year or a peril) names the tile properties of the columns.
+    Raster maps show the communes as one image, whose clicks are located
+    through the commune-ID grid.
+
+    It returns the row position of the commune clicked since the last rerun;
+    pre-rendered maps report no click.
+    """
+    selected_bounds = None if selected is None else commune_index(sources['insee'])['bounds'][selected].tolist()
+
+    if map_mode == TILE_MODE:
+        url = f"tiles/{commune_tiles(risk_version, event_version)}/{{z}}/{{x}}/{{y}}.pbf"
+        properties = [field if field in STATIC_FIELDS else f"{field}_{variant}" for field in fields]
+        popup = None if selected is None else rm.tooltip_html(gdf.iloc[selected], fields, aliases, footer=footer)
+        click = cc.vector_tiles(url, max(risk_tiles.TILE_ZOOMS), colormap, f"{value_column}_{variant}", properties, aliases,
+                                selected=selected, selected_bounds=selected_bounds, popup=popup, fill_opacity=fill_opacity, key=f"{key}_tiles")
+        return clicked_commune(key, click)
+
+    if map_mode == STYLE_MODE:
+        columns = {field: gdf[field].to_numpy() for field in fields if field not in STATIC_FIELDS}
+        click = cc.choropleth(commune_geometry(sources['insee']), colormap, gdf[value_column].to_numpy(), columns, fields, aliases,
+                              selected=selected, selected_bounds=selected_bounds, footer=footer, fill_opacity=fill_opacity, key=f"{key}_styles")
+        return clicked_commune(key, click)
+
+    if map_mode == ARTIFACT_MODE:
+        with profiler.stage('serve_artifact') as stage:
+            artifact = ra.artifact_key(gdf, value_column, colormap, fields, aliases, fill_opacity, sources['insee'])
+            html = artifact_cache().get(artifact)
+            stage['cache'] = 'miss' if html is None else 'hit'
+            if html is None:
+                html = ra.render_artifact(gdf, value_column, colormap, fields, aliases, fill_opacity, geometry_pyramid(sources['insee']))
+                artifact_cache().put(artifact, html)
+            if selected is not None and not gdf.geometry.iloc[selected].is_empty:
+                popup = rm.tooltip_html(gdf.iloc[selected], fields, aliases, footer=footer)
+                html = ra.select_commune(html, gdf.geometry.iloc[selected], popup, rm.bounds_zoom(selected_bounds, MAP_WIDTH, MAP_HEIGHT))
+            st.components.v1.html(html, height=MAP_HEIGHT)
+        return None
+
+    build = profiler.begin('build_map')
+
+    raster, level = None, None
+    if map_mode == RASTER_MODE:
+        # Color the commune-ID grid into a single image, whatever the zoom
+        raster = commune_raster(sources['insee'])
+        m = rm.base_map()
+        rr.raster_layer(raster, colormap, gdf[value_column].to_numpy(), fill_opacity=fill_opacity).add_to(m)
+        colormap.add_to(m)
+    else:
+        # Keep the view of the map to pick the pyramid level of its zoom
+        view = st.session_state.setdefault(f"{key}_view", {'center': rm.MAP_CENTER, 'zoom': rm.MAP_ZOOM})
+        level = risk_data.lod_level(view['zoom'])
+
+        # Create a Folium map with all communes in a single layer
+        m = rm.choropleth_map(gdf, value_column, colormap, fields, aliases, geometry_pyramid(sources['insee']),
+                              view['center'], view['zoom'], fill_opacity=fill_opacity)
+
+    # Highlight the selected commune in a layer added to the map in place,
+    # and jump to it, without rebuilding the map
+    selection, center, zoom = None, None, None
+    if selected is not None and not gdf.geometry.iloc[selected].is_empty:
+        row = gdf.iloc[selected]
         geom = row['geometry']
-        if geom.is_empty or geom is None:
-            continue
-        color = colormap(row['average_risk'])
-        tooltip_text = (
-            f"<div style='font-size: 16px;'><b>INSEE:</b> {row['Code INSEE']}<br><b>Commune:</b> {row['Commune']}<br>"
-            f"<b>Risque Inondations et/ou coulées de boue ({selected_year}):</b> {row['risk_coul']}<br>"
-            f"<b>Risque Inondations remontée nappe ({selected_year}):</b> {row['risk_rem']}<br>"
-            f"<b>Risque Sécheresse ({selected_year}):</b> {row['risk_sech']}<br>"
-            f"<b>Risque Historique:</b> {row['normalized_historical_risk_score']}<br>"
-            f"<b>Risque Moyen:</b> {row['average_risk']}<br>"
-            f"<b>Niveau de risque:</b> (Aucun risque) 0  -  1 (Risque maximum)</div>"
-        )
-        geojson = folium.GeoJson(
+        selection = folium.FeatureGroup(name="selection")
+        folium.GeoJson(
             data=geom,
-            tooltip=tooltip_text,
-            style_function=lambda x, color=color: {
-                'fillColor': color, 'color': 'black', 'weight': 0.5, 'fillOpacity': 0.8
-            },
-            name=row['Commune']
-        ).add_to(m)
-        
-        if row['Commune'] == selected_commune:
-            selected_geom = geom
-            selected_geojson = geojson
-            folium.GeoJson(
-                data=geom,
-                style_function=lambda x: {'fillColor': 'orange', 'color': 'black', 'weight': 0.5, 'fillOpacity': 0.6}
-            ).add_to(m)
-            popup = folium.Popup(tooltip_text, max_width=300)
-            marker = folium.Marker(
-                location=[geom.centroid.y, geom.centroid.x],
-                icon=folium.Icon(icon="info-sign"),
-                popup=popup
-            ).add_to(m)
-    
-    if selected_geom:
-        bounds = selected_geom.bounds
-        m.fit_bounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]])
-        popup.add_to(marker)
-    
-    colormap.caption = f'{selected_year}'
-    colormap.add_to(m)
-    
-    
+            style_function=lambda x: {'fillColor': 'orange', 'color': 'black', 'weight': 0.5, 'fillOpacity': 0.6}
+        ).add_to(selection)
+        folium.Marker(
+            location=[geom.centroid.y, geom.centroid.x],
+            icon=folium.Icon(icon="info-sign"),
+            popup=folium.Popup(rm.tooltip_html(row, fields, aliases, footer=footer), max_width=300)
+        ).add_to(selection)
+        center = [geom.centroid.y, geom.centroid.x]
+        zoom = rm.bounds_zoom(selected_bounds, MAP_WIDTH, MAP_HEIGHT)
+
+    profiler.end(build)
+
     # Display the Folium map in Streamlit
-    st_data = st_folium(m, width=1600, height=600, key="map1")
+    with profiler.stage('send_map'):
+        st_data = st_folium(m, width=MAP_WIDTH, height=MAP_HEIGHT, center=center, zoom=zoom, feature_group_to_add=selection,
+                            key=key if raster is None else f"{key}_raster")
+    clicked = clicked_commune(key, st_data.get('last_clicked') if st_data else None, raster)
+
+    # Rebuild the map at the pyramid level of a new zoom
+    if level is not None and st_data and st_data.get('zoom') is not None and risk_data.lod_level(st_data['zoom']) != level:
+        bounds = st_data['bounds']
+        view['center'] = [(bounds['_southWest']['lat'] + bounds['_northEast']['lat']) / 2, (bounds['_southWest']['lng'] + bounds['_northEast']['lng']) / 2]
+        view['zoom'] = st_data['zoom']
+        st.session_state.pop(f"{key}_clicked", None)
+        st.rerun()
+    return clicked
 
 
 #==============================================================================
-# Tab 2
+# Tab 1
 #==============================================================================
+# Cached risk cube: commune x peril x year, aligned to inseedf
+@profiler.cached(shared_data)
+def risk_cube(version):
+    return risk_data.freeze(risk_data.build_risk_cube(inseedf['Code INSEE'], tab1_cache(sources['coul']), tab2_cache(sources['rem']),
+                                     tab3_cache(sources['sech']), load_historical(sources['historical'])))
 
-def render_tab2():
-    """
-    This function renders Tab 2 - historic events
-    """
-    # Embedded tabs
-    tab1, tab2 = st.tabs(["Carte des inondations historiques (2000 - 2023)", "Carte des sécheresses historiques (2000 - 2023)"])
+# Fingerprints of the sources of the risk cube
+risk_version = tuple(sources[name] for name in RISK_SOURCES)
 
-    with tab1:
-        # Load the event data
-        events_df = inon_events()
-        events_df['dat_deb'] = pd.to_datetime(events_df['dat_deb'])
-        events_df['dat_fin'] = pd.to_datetime(events_df['dat_fin'])
+# Columns of the tab 1 map
+RISK_FIELDS = ['risk_coul', 'risk_rem', 'risk_sech', 'normalized_historical_risk_score', 'average_risk']
 
-        # Calculate event duration
-        events_df['duration'] = (events_df['dat_fin'] - events_df['dat_deb']).dt.days + 1
+@profiler.profiled
+def risk_frame(cube, year_index):
+    """
+    This function slices the risks of a year from the risk cube; communes
+    without every risk get no average risk and are not shown
+    """
+    return risk_data.risk_frame(inseedf, cube, year_index)
 
-        # Calculate number of events and average duration per commune
-        event_counts = events_df.groupby('cod_commune').size().reset_index(name='event_count')
-        average_duration = events_df.groupby('cod_commune')['duration'].mean().reset_index(name='average_duration')
+@profiler.profiled
+def risk_map_args(cube, year_index):
+    """
+    This function returns the inputs of the risk map of a year: the risks of
+    the year, its colormap and tooltip
+    """
+    return ra.risk_map_args(inseedf, cube, year_index)
 
-        event_counts['cod_commune'] = event_counts['cod_commune'].astype(str)
-        average_duration['cod_commune'] = average_duration['cod_commune'].astype(str)
+# Perils of the predicted intensities of the drill-down, in the cube order
+PREDICTION_LABELS = ['Inondations et/ou coulées de boue', 'Inondations remontée nappe', 'Sécheresse']
 
-        # Merge event counts and average duration with inseedf
-        df = inseedf.merge(event_counts, left_on='Code INSEE', right_on='cod_commune', how='left').merge(average_duration, on='cod_commune', how='left')
+# Columns of the event table of the drill-down
+HISTORY_COLUMNS = {'cod_nat_catnat': 'Arrêté', 'lib_risque_jo': 'Risque', 'dat_deb': 'Début', 'dat_fin': 'Fin', 'duration': 'Durée (jours)'}
 
-        # Replace NaN values with 0
-        df['event_count'] = df['event_count'].fillna(0).astype(int)
-        df['average_duration'] = df['average_duration'].fillna(0).round(2)
+@profiler.profiled
+def render_commune_history(position, cube):
+    """
+    This function renders the drill-down of a commune: the timeline and
+    durations of its CatNat events, and its predicted intensities
+    """
+    if source_errors(EVENT_SOURCES):
+        return
 
-        # Create a GeoDataFrame
-        gdf = gpd.GeoDataFrame(df, geometry='geometry')
+    name = inseedf['Commune'].iat[position]
+    events = risk_data.commune_events(event_store(sources['insee']).refresh(), inseedf['Code INSEE'].iat[position])
+    events = events.assign(lib_risque_jo=events['lib_risque_jo'].astype(str))
 
-        # Create a select box to toggle between event count and average duration
-        display_option = st.selectbox("Sélectionnez::", options=["Nombre d'Inondations", "Durée moyenne annuelle des inondations"], key="event1")
+    col1, col2 = st.columns(2)
 
-        if display_option == "Nombre d'Inondations":
-            colormap = cm.LinearColormap(colors=['#ffffcc', '#41b6c4', '#0c2c84'], vmin=gdf['event_count'].min(), vmax=gdf['event_count'].max())
-            selected_column = 'event_count'
+    # Events as bars from their start to their end date
+    with col1:
+        if events.empty:
+            st.info(f"Aucun événement enregistré pour {name}.")
         else:
-            colormap = cm.LinearColormap(colors=['#ffffcc', '#41b6c4', '#0c2c84'], vmin=gdf['average_duration'].min(), vmax=gdf['average_duration'].max())
-            selected_column = 'average_duration'
-
-        # Initialize a Folium map
-        m = folium.Map(location=[50.629250, 3.057256], zoom_start=8)
-
-        for _, row in gdf.iterrows():
-            geom = row['geometry']
-            if geom.is_empty or geom is None:
-                continue
-            color = colormap(row[selected_column])
-            tooltip_text = f"<div style='font-size: 16px;'><b>Commune:</b> {row['Commune']}<br><b>{display_option}:</b> {row[selected_column]}</div>"
-            folium.GeoJson(
-                data=geom,
-                tooltip=tooltip_text,
-                style_function=lambda x, color=color: {
-                    'fillColor': color, 'color': 'black', 'weight': 0.5, 'fillOpacity': 1
-                }
-            ).add_to(m)
-
-        colormap.caption = display_option
-        colormap.add_to(m)
-
-        # Display the Folium map in Streamlit
-        st_data = st_folium(m, width=1600, height=600, key="map4")
-
-    with tab2:
-        # Load the event data
-        events_df = sech_events()
-        events_df['dat_deb'] = pd.to_datetime(events_df['dat_deb'])
-        events_df['dat_fin'] = pd.to_datetime(events_df['dat_fin'])
+            fig = px.timeline(events.assign(dat_fin=events['dat_fin'] + pd.Timedelta(days=1)), x_start='dat_deb', x_end='dat_fin',
+                              y='lib_risque_jo', color='lib_risque_jo', hover_data={'cod_nat_catnat': True, 'duration': True},
+                              labels={'lib_risque_jo': 'Risque', 'cod_nat_catnat': 'Arrêté', 'duration': 'Durée (jours)'},
+                              title=f"{name} - Événements CatNat ({len(events)})")
+            fig.update_layout(showlegend=False, plot_bgcolor='white', yaxis_title='')
+            st.plotly_chart(fig, use_container_width=True)
+
+    # Predicted intensities of each peril over the prediction years
+    with col2:
+        intensities = pd.DataFrame(cube['values'][position, :len(PREDICTION_LABELS), :].T, index=cube['years'], columns=PREDICTION_LABELS)
+        fig = px.line(intensities, markers=True, labels={'index': '', 'value': 'Intensité prédite', 'variable': 'Risque'},
+                      title=f"{name} - Intensités prédites")
+        fig.update_layout(plot_bgcolor='white')
+        st.plotly_chart(fig, use_container_width=True)
 
-        # Calculate event duration
-        events_df['duration'] = (events_df['dat_fin'] - events_df['dat_deb']).dt.days + 1
+    if not events.empty:
+        st.dataframe(events[list(HISTORY_COLUMNS)].rename(columns=HISTORY_COLUMNS), hide_index=True, use_container_width=True)
 
-        # Calculate number of events and average duration per commune
-        event_counts = events_df.groupby('cod_commune').size().reset_index(name='event_count')
-        average_duration = events_df.groupby('cod_commune')['duration'].mean().reset_index(name='average_duration')
+@profiler.profiled
+def render_tab1():
+    """
+    This function renders Tab 1 - Map of risks at INSEE level
+    """
+    if source_errors(RISK_SOURCES):
+        return
 
-        event_counts = events_df.groupby('cod_commune').size().reset_index(name='event_count')
-        average_duration = events_df.groupby('cod_commune')['duration'].mean().reset_index(name='average_duration')
+    cube = risk_cube(risk_version)
 
-        # Ensure 'Code INSEE' in inseedf and 'cod_commune' in event_counts/average_duration are the same data type
-        inseedf['Code INSEE'] = inseedf['Code INSEE'].astype(str).str.strip()
-        event_counts['cod_commune'] = event_counts['cod_commune'].astype(str).str.strip()
-        average_duration['cod_commune'] = average_duration['cod_commune'].astype(str).str.strip()
+    # Create a select box for the year selection
+    selected_year = st.selectbox("Sélectionnez l'année:", options=cube['years'], key="select_year1")
+    year_index = cube['years'].index(selected_year)
 
-        # Merge event counts and average duration with inseedf
-        df = inseedf.merge(event_counts, left_on='Code INSEE', right_on='cod_commune', how='left').merge(average_duration, left_on='Code INSEE', right_on='cod_commune', how='left')
+    # Slice the risks of the selected year, with its colormap and tooltip
+    args = risk_map_args(cube, year_index)
 
-        # Replace NaN values with 0
-        df['event_count'] = df['event_count'].fillna(0).astype(int)
-        df['average_duration'] = df['average_duration'].fillna(0).round(2)
+    # A commune clicked on the map is selected through the search widgets
+    if 'clicked_commune1' in st.session_state:
+        clicked = st.session_state.pop('clicked_commune1')
+        st.session_state['search_commune1'] = str(inseedf['Code INSEE'].iat[clicked])
 
-        # Create a GeoDataFrame
-        gdf = gpd.GeoDataFrame(df, geometry='geometry')
+    # Search the communes with a risk by name or INSEE code, the best match being selected
+    search = st.text_input("Entrez le nom ou le code INSEE de la commune:", key="search_commune1")
+    matches = risk_data.search_communes(commune_index(sources['insee']), search, mask=cube['complete'])
+    selected = st.selectbox(
+        "Sélectionnez la commune:", options=[None] + matches, index=1 if matches else 0, key="select_commune1",
+        format_func=lambda i: '' if i is None else f"{inseedf['Commune'].iat[i]} ({inseedf['Code INSEE'].iat[i]})",
+    )
 
-        # Create a select box to toggle between event count and average duration
-        display_option = st.selectbox("Sélectionnez:", options=["Nombre de sécheresses", "Durée moyenne annuelle de la sécheresse"], key="event2")
+    clicked = render_map(**args, key="map1", variant=selected_year, selected=selected, footer=rm.RISK_SCALE)
+    if clicked is not None and cube['complete'][clicked] and clicked != selected:
+        st.session_state['clicked_commune1'] = clicked
+        st.rerun()
 
-        if display_option == "Nombre de sécheresses":
-            colormap = cm.LinearColormap(colors=['#FFFFB2','#FFD700', '#FFC300','#FFB000', '#FF8C00', '#FF7000', '#FF4500', '#FF2400', '#FF0000', '#CC0000','#8B0000'], vmin=gdf['event_count'].min(), vmax=gdf['event_count'].max())
-            selected_column = 'event_count'
-        else:
-            colormap = cm.LinearColormap(colors=['#FFFFB2','#FFD700', '#FFC300','#FFB000', '#FF8C00', '#FF7000', '#FF4500', '#FF2400', '#FF0000', '#CC0000','#8B0000'], vmin=gdf['average_duration'].min(), vmax=gdf['average_duration'].max())
-            selected_column = 'average_duration'
-
-        # Initialize a Folium map
-        m = folium.Map(location=[50.629250, 3.057256], zoom_start=8)
-
-        for _, row in gdf.iterrows():
-            geom = row['geometry']
-            if geom.is_empty or geom is None:
-                continue
-            color = colormap(row[selected_column])
-            tooltip_text = f"<div style='font-size: 16px;'><b>Commune:</b> {row['Commune']}<br><b>{display_option}:</b> {row[selected_column]}</div>"
-            folium.GeoJson(
-                data=geom,
-                tooltip=tooltip_text,
-                style_function=lambda x, color=color: {
-                    'fillColor': color, 'color': 'black', 'weight': 0.5, 'fillOpacity': 1
-                }
-            ).add_to(m)
-
-        colormap.caption = display_option
-        colormap.add_to(m)
+    # Drill-down into the history of the selected commune
+    if selected is not None and st.toggle("Historique de la commune", key="history1"):
+        render_commune_history(selected, cube)
 
-        # Display the Folium map in Streamlit
-        st_data = st_folium(m, width=1600, height=600, key="map4")
-    
 
-    
-    
 #==============================================================================
-# Tab 3
+# Tab 2
 #==============================================================================
 
-def render_tab3():
-     
-    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["Inondations - Top 10 des Communes","Sécheresses - Top 10 des Communes","Inondations par mois","Sécheresses par mois","Nombre d'Événements", "Carte des Sols"])
-    
-    with tab1:
-        # Load the data
-        events_df = inon_events()
+# Columns of the tab 2 maps
+EVENT_FIELDS = ['event_count', 'average_duration']
 
-        # Filter events from 2000 to end of 2023
-        start_date = datetime(1995, 1, 1)  
-        end_date = datetime(2023, 12, 31)   
-        
-        events_df = events_df[(events_df['dat_deb'] >= start_date) & (events_df['dat_deb'] <= end_date)]
+@profiler.profiled
+def event_frame(peril):
+    """
+    This function joins the event counts and average durations of a peril
+    with inseedf, replacing NaN values with 0
+    """
+    return risk_data.event_frame(inseedf, event_aggregates(peril))
 
-        # Group by commune and date, and count the number of events
-        commune_date_counts = events_df.groupby(['lib_commune', 'dat_deb']).size().reset_index(name='event_count')
+@profiler.profiled
+def event_map_args(peril, metric_index):
+    """
+    This function returns the inputs of the event map of a peril and metric:
+    the events of the communes, the colormap and tooltip
+    """
+    return ra.event_map_args(inseedf, event_aggregates(peril), peril, metric_index)
 
-        # Get the top 10 communes by total number of events
-        top_10_communes = commune_date_counts.groupby('lib_commune')['event_count'].sum().nlargest(10).index
-        top_10_data = commune_date_counts[commune_date_counts['lib_commune'].isin(top_10_communes)]
+@profiler.profiled
+def render_event_map(peril, label, select_key, map_key):
+    """
+    This function renders the map of the number of events or of the average
+    duration of the events of a peril in each commune
+    """
+    if source_errors(EVENT_SOURCES):
+        return
 
-        # Pivot the data
-        pivot_data = top_10_data.pivot(index='dat_deb', columns='lib_commune', values='event_count')
+    # Create a select box to toggle between event count and average duration
+    options = [option for _, option in rm.EVENT_METRICS[peril]]
+    display_option = st.selectbox(label, options=options, key=select_key)
 
-        # Calculate the cumulative sum for events
-        cumulative_data = pivot_data.cumsum()
+    render_map(**event_map_args(peril, options.index(display_option)), key=map_key, variant=peril)
 
-        # Interpolate to create a continuous line
-        cumulative_data = cumulative_data.interpolate(method='linear')
+@profiler.profiled
+def render_tab2():
+    """
+    This function renders Tab 2 - historic events
+    """
+    # Embedded views
+    render_views([
+        ("Carte des inondations historiques (2000 - 2023)", lambda: render_event_map('inon', "Sélectionnez::", "event1", "map4")),
+        ("Carte des sécheresses historiques (2000 - 2023)", lambda: render_event_map('sech', "Sélectionnez:", "event2", "map5")),
+    ], key="view2")
+    
 
-        # Fill NA
-        cumulative_data.fillna(0, inplace=True)
+    
+    
+#==============================================================================
+# Tab 3
+#==============================================================================
 
-        # Plot running total events over time using Plotly
-        fig = px.line(cumulative_data, labels={'value': "No.  d'Inondations", 'dat_deb': ''}, title='Inondations (Top 10 des Communes)')
-        fig.update_layout(legend_title_text='Commune', plot_bgcolor='white')
+# Largest number of communes of the top communes charts
+TOP_MAX = 50
 
-        # Display the Plotly chart in Streamlit
-        st.plotly_chart(fig, use_container_width=True)
-        
-    with tab2:
-         # Load the data
-         events_df = sech_events()
+@profiler.profiled
+def render_top_communes(peril, ylabel, title):
+    """
+    This function renders the running total of events of the top communes
+    over a window of dates and a number of communes picked by the user
+    """
+    if source_errors(EVENT_SOURCES):
+        return
 
-         # Filter events from 2000 to end of 2023
-         start_date = datetime(1995, 1, 1)  
-         end_date = datetime(2023, 12, 31)   
-        
-         events_df = events_df[(events_df['dat_deb'] >= start_date) & (events_df['dat_deb'] <= end_date)]
-         
-         # Group by commune and date, and count the number of events
-         commune_date_counts = events_df.groupby(['lib_commune', 'dat_deb']).size().reset_index(name='event_count')
+    index = event_aggregates(peril)['commune_dates']
+    if not len(index['dates']):
+        st.info("Aucun événement enregistré.")
+        return
 
-         # Get the top 10 communes by total number of events
-         top_10_communes = commune_date_counts.groupby('lib_commune')['event_count'].sum().nlargest(10).index
-         top_10_data = commune_date_counts[commune_date_counts['lib_commune'].isin(top_10_communes)]
+    # Window of start dates and number of communes, the defaults clipped to the events
+    first, last = pd.Timestamp(index['dates'].min()).date(), pd.Timestamp(index['dates'].max()).date()
+    default = (min(max(pd.Timestamp(risk_data.TOP_START).date(), first), last), max(min(pd.Timestamp(risk_data.TOP_END).date(), last), first))
+    col1, col2 = st.columns([4, 1])
+    start, end = col1.slider("Période:", min_value=first, max_value=last, value=default, format="DD/MM/YYYY", key=f"top_window_{peril}")
+    top_n = col2.number_input("Nombre de communes:", min_value=1, max_value=TOP_MAX, value=risk_data.TOP_N, key=f"top_n_{peril}")
 
-         # Pivot the data
-         pivot_data = top_10_data.pivot(index='dat_deb', columns='lib_commune', values='event_count')
+    cumulative_data = risk_data.top_communes(index, start, end, top_n)['cumulative']
 
-         # Calculate the cumulative sum for events
-         cumulative_data = pivot_data.cumsum()
+    # Plot running total events over time using Plotly
+    title = f"{title} - Top {top_n} des Communes ({start:%d/%m/%Y} - {end:%d/%m/%Y})"
+    fig = px.line(cumulative_data, labels={'value': ylabel, 'dat_deb': ''}, title=title)
+    fig.update_layout(legend_title_text='Commune', plot_bgcolor='white')
 
-         # Interpolate to create a continuous line
-         cumulative_data = cumulative_data.interpolate(method='linear')
+    # Display the Plotly chart in Streamlit
+    st.plotly_chart(fig, use_container_width=True)
 
-         # Fill NA
-         cumulative_data.fillna(0, inplace=True)
+@profiler.profiled
+def render_monthly(peril, title):
+    """
+    This function renders the total number of events per month
+    """
+    if source_errors(EVENT_SOURCES):
+        return
 
-         # Plot running total events over time using Plotly
-         fig = px.line(cumulative_data, labels={'value': 'No. de Sécheresses', 'dat_deb': ''}, title='Sécheresses (Top 10 des Communes)')
-         fig.update_layout(legend_title_text='Commune', plot_bgcolor='white')
+    monthly_totals = event_aggregates(peril)['monthly']
 
-         # Display the Plotly chart in Streamlit
-         st.plotly_chart(fig, use_container_width=True)
+    # Plotting 
+    fig = px.bar(monthly_totals, x='month', y='events', labels={'month': '', 'events': 'Total des événements'}, title=title)
+    
+    # Set x values
+    fig.update_layout(
+        xaxis=dict(
+            tickmode='array',
+            tickvals=list(range(1, 13)),
+            ticktext=['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December'],
+            tickangle=45
+        ),
+        yaxis_title='Total Events',
+        plot_bgcolor='white',
+    )
+    
+    st.plotly_chart(fig, use_container_width=True)
 
-    with tab3:
-        # Load data
-        inon_events_df = inon_events()
-        
-        # Extract month
-        inon_events_df['month'] = inon_events_df['dat_deb'].dt.month
-        
-        # Aggregate total events per month
-        monthly_totals = inon_events_df.groupby('month').size().reset_index(name='events')
-        
-        # Plotting 
-        fig = px.bar(monthly_totals, x='month', y='events', labels={'month': '', 'events': 'Total des événements'}, title='Inondations totales par mois')
-        
-        # Set x values
-        fig.update_layout(
-            xaxis=dict(
-                tickmode='array',
-                tickvals=list(range(1, 13)),
-                ticktext=['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December'],
-                tickangle=45
-            ),
-            yaxis_title='Total Events',
-            plot_bgcolor='white',
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
-        
-    with tab4:
-        # Load data
-        sech_events_df = sech_events()
-        
-        # Extract month
-        sech_events_df['month'] = sech_events_df['dat_deb'].dt.month
-        
-        # Aggregate total events per month
-        monthly_totals = sech_events_df.groupby('month').size().reset_index(name='events')
-        
-        # Plotting 
-        fig = px.bar(monthly_totals, x='month', y='events', labels={'month': '', 'events': 'Total des événements'}, title='Sécheresses totales par mois')
-        
-        # Set x values
-        fig.update_layout(
-            xaxis=dict(
-                tickmode='array',
-                tickvals=list(range(1, 13)),
-                ticktext=['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December'],
-                tickangle=45
-            ),
-            yaxis_title='Total Events',
-            plot_bgcolor='white',
+@profiler.profiled
+def render_catnat_counts():
+    """
+    This function renders the number of CatNat events per peril over time
+    """
+    if source_errors(EVENT_SOURCES):
+        return
+
+    # Events after 2000 per date and disaster name
+    cat_counts = catnat_counts()
+
+    # Plot the disasters over time using Plotly
+    fig = go.Figure()
+    for col in cat_counts.columns:
+        fig.add_trace(go.Scatter(x=cat_counts.index, y=cat_counts[col], mode='lines', name=col))
+
+    fig.update_layout(
+        title="Nombre d'Événements (After 2000)",
+        xaxis_title='Date',
+        yaxis_title="Nombre d'Événements",
+        legend_title="Type d'Événement",
+        plot_bgcolor='white',
+        xaxis=dict(
+            tickformat='%Y',
+            dtick='M48',  
+            tickangle=-45
+        ),
+        yaxis=dict(
+            dtick=50  
         )
-        
-        st.plotly_chart(fig, use_container_width=True)
+    )
 
+    # Display the Plotly chart in Streamlit
+    st.plotly_chart(fig, use_container_width=True)
 
-         
-    with tab5:
-        catnat = cat_events()
-
-        # Filter after 2000
-        catnat = catnat[catnat['dat_deb'].dt.year > 2000]
-
-        # Group by date and disaster name
-        cat_counts = catnat.groupby(['dat_deb', 'lib_risque_jo']).size().unstack(fill_value=0)
-
-       
-        # Select relevant columns
-        selected_columns = ['Sécheresse', 'Inondations et/ou coulées de boue', 'Inondations remontée nappe']
-        cat_counts = cat_counts[selected_columns]
-
-        # Plot the disasters over time using Plotly
-        fig = go.Figure()
-        for col in selected_columns:
-            fig.add_trace(go.Scatter(x=cat_counts.index, y=cat_counts[col], mode='lines', name=col))
-
-        fig.update_layout(
-            title="Nombre d'Événements (After 2000)",
-            xaxis_title='Date',
-            yaxis_title="Nombre d'Événements",
-            legend_title="Type d'Événement",
-            plot_bgcolor='white',
-            xaxis=dict(
-                tickformat='%Y',
-                dtick='M48',  
-                tickangle=-45
-            ),
-            yaxis=dict(
-                dtick=50  
-            )
-        )
+@profiler.profiled
+def render_soil_map():
+    """
+    This function renders the soil map
+    """
+    if source_errors(['soil']):
+        return
 
-        # Display the Plotly chart in Streamlit
-        st.plotly_chart(fig, use_container_width=True)
-        
-    with tab6:
-        
-        html_file_path = 'sol_map.html'
-        # Read the content of the HTML file
-        with open(html_file_path, 'r', encoding='utf-8') as file:
-            html_content = file.read()
-        
-        st.components.v1.html(html_content, width=1200, height=600, scrolling=True)
+    # Page served by the dashboard, cached by the browser
+    st.components.v1.iframe(soil_map(sources['soil']), width=1200, height=600, scrolling=True)
+
+@profiler.profiled
+def render_tab3():
+    """
+    This function renders Tab 3 - data exploration
+    """
+    render_views([
+        ("Inondations - Top des Communes", lambda: render_top_communes('inon', "No.  d'Inondations", 'Inondations')),
+        ("Sécheresses - Top des Communes", lambda: render_top_communes('sech', 'No. de Sécheresses', 'Sécheresses')),
+        ("Inondations par mois", lambda: render_monthly('inon', 'Inondations totales par mois')),
+        ("Sécheresses par mois", lambda: render_monthly('sech', 'Sécheresses totales par mois')),
+        ("Nombre d'Événements", render_catnat_counts),
+        ("Carte des Sols", render_soil_map),
+    ], key="view3")
 
 # Main body
 render_header()
 
-# Render the tabs
-tab1, tab2, tab3 = st.tabs(["Carte des risques","Cartes d'événements historiques",  "Exploration des données"])
-with tab1:
-    render_tab1()
-with tab2:
-    render_tab2()
-with tab3:
-    render_tab3()
+# Map mode of every map
+map_mode = st.sidebar.radio("Mode de carte:", options=MAP_MODES, key="map_mode")
+
+# Navigation mode of every set of views
+navigation_mode = st.sidebar.radio("Navigation:", options=NAVIGATION_MODES, key="navigation_mode")
 
+# Render the views
+render_views([
+    ("Carte des risques", render_tab1),
+    ("Cartes d'événements historiques", render_tab2),
+    ("Exploration des données", render_tab3),
+], key="view")
 
 
 
 
 
 
-# Customize the dashboard with CSS 
+
+# Customize the dashboard with CSS
 st.markdown(
     """
     <style>
@@ -568,6 +736,13 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+# Log the profile of the rerun, and show it in the hidden debug panel
+profile = profiler.finish()
+if st.query_params.get('debug') == '1':
+    with st.sidebar.expander("Profil du rechargement", expanded=True):
+        st.caption(f"{profile['seconds']:.3f} s")
+        st.dataframe(risk_profile.profile_frame(profile), hide_index=True, use_container_width=True)
+
 
 ###############################################################################
 # END
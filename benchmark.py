@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Benchmark
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import shapely
+
+
+# The dashboard and its data sources, read from the working directory
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DASHBOARD = os.path.join(REPO_DIR, 'CA_Risk_Dashboard.py')
+COMMUNES_CSV = 'insee_df.csv'
+PREDICTION_CSVS = ['coul_predictions.csv', 'rem_predictions.csv', 'sech_predictions.csv']
+EVENT_CSVS = ['inon_events.csv', 'sech_events.csv']
+HISTORICAL_CSV = 'historical_risk.csv'
+SOIL_HTML = 'sol_map.html'
+
+# Scale-up copies get their commune and department codes prefixed by their
+# number, and are laid out on a grid next to the source area. Codes are read
+# as text, as the dashboard does.
+CODE_COLUMNS = {'Code INSEE': str, 'Code Département': str, 'cod_commune': str}
+SEED = 0
+
+# Elements whose serialized size is reported as payload
+PAYLOAD_TYPES = ['component_instance', 'plotly_chart', 'iframe']
+
+OUTPUT_JSON = 'benchmark.json'
+
+
+#==============================================================================
+# Datasets
+#==============================================================================
+def copy_offsets(copies, bounds):
+    """
+    This function places the copies of an area on a square grid, and returns
+    the (dx, dy) offset in degrees of each one
+    """
+    min_x, min_y, max_x, max_y = bounds
+    columns = int(np.ceil(np.sqrt(copies)))
+    return [((j % columns) * (max_x - min_x), (j // columns) * (max_y - min_y)) for j in range(copies)]
+
+
+def scale_communes(communes, scale):
+    """
+    This function repeats the communes scale times, each copy with its own
+    codes, names and geometries shifted next to the source area
+    """
+    geometry = shapely.from_wkt(communes['geometry'].to_numpy())
+    frames = []
+    for j, (dx, dy) in enumerate(copy_offsets(scale, shapely.total_bounds(geometry))):
+        copy = communes.copy()
+        if j:
+            copy['Code INSEE'] = f'{j}' + copy['Code INSEE']
+            copy['Code Département'] = f'{j}' + copy['Code Département']
+            copy['Commune'] = copy['Commune'] + f' {j}'
+            copy['geometry'] = shapely.to_wkt(shapely.transform(geometry, lambda coords: coords + [dx, dy]), rounding_precision=-1)
+        frames.append(copy)
+    return pd.concat(frames, ignore_index=True)
+
+
+def scale_codes(df, scale, code_column, name_column=None):
+    """
+    This function repeats the rows of a table keyed by commune scale times,
+    each copy keyed by the codes of the matching commune copy
+    """
+    frames = []
+    for j in range(scale):
+        copy = df.copy()
+        if j:
+            copy[code_column] = f'{j}' + copy[code_column]
+            if name_column is not None:
+                copy[name_column] = copy[name_column] + f' {j}'
+        frames.append(copy)
+    return pd.concat(frames, ignore_index=True)
+
+
+def prepare_data(data_dir, work_dir, scale):
+    """
+    This function fills the working directory with the dashboard sources,
+    linked as they are at scale 1 and repeated scale times otherwise. Missing
+    sources are replaced by synthetic ones.
+
+    It returns the sizes of the dataset and the synthetic sources.
+    """
+    synthetic = []
+    sources = [COMMUNES_CSV] + PREDICTION_CSVS + EVENT_CSVS
+    for filename in sources + [HISTORICAL_CSV, SOIL_HTML]:
+        if scale == 1 and os.path.exists(os.path.join(data_dir, filename)):
+            os.symlink(os.path.abspath(os.path.join(data_dir, filename)), os.path.join(work_dir, filename))
+
+    communes = pd.read_csv(os.path.join(data_dir, COMMUNES_CSV), dtype=CODE_COLUMNS)
+    events = sum(len(pd.read_csv(os.path.join(data_dir, filename))) for filename in EVENT_CSVS)
+    if scale > 1:
+        scale_communes(communes, scale).to_csv(os.path.join(work_dir, COMMUNES_CSV), index=False)
+        for filename in PREDICTION_CSVS:
+            df = pd.read_csv(os.path.join(data_dir, filename), dtype=CODE_COLUMNS)
+            scale_codes(df, scale, 'Code INSEE').to_csv(os.path.join(work_dir, filename), index=False)
+        for filename in EVENT_CSVS:
+            df = pd.read_csv(os.path.join(data_dir, filename), dtype=CODE_COLUMNS)
+            scale_codes(df, scale, 'cod_commune', 'lib_commune').to_csv(os.path.join(work_dir, filename), index=False)
+
+    historical_path = os.path.join(data_dir, HISTORICAL_CSV)
+    if os.path.exists(historical_path):
+        if scale > 1:
+            scale_codes(pd.read_csv(historical_path, dtype=CODE_COLUMNS), scale, 'Code INSEE').to_csv(os.path.join(work_dir, HISTORICAL_CSV), index=False)
+    else:
+        codes = scale_codes(communes[['Code INSEE']], scale, 'Code INSEE')['Code INSEE']
+        scores = np.random.default_rng(SEED).random(len(codes))
+        pd.DataFrame({'Code INSEE': codes, 'normalized_historical_risk_score': scores}).to_csv(os.path.join(work_dir, HISTORICAL_CSV), index=False)
+        synthetic.append(HISTORICAL_CSV)
+
+    if not os.path.exists(os.path.join(data_dir, SOIL_HTML)):
+        with open(os.path.join(work_dir, SOIL_HTML), 'w', encoding='utf-8') as file:
+            file.write('<html><body></body></html>')
+        synthetic.append(SOIL_HTML)
+
+    return {'communes': len(communes) * scale, 'events': events * scale, 'synthetic': synthetic}
+
+
+#==============================================================================
+# Measures
+#==============================================================================
+def max_rss_mb():
+    """
+    This function returns the peak resident memory of the process so far, in MB
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024, 1)
+
+
+def payload_sizes(at):
+    """
+    This function returns the serialized size in bytes of the maps, figures
+    and HTML frames of the last run, by element
+    """
+    sizes = {}
+    def walk(node):
+        for child in getattr(node, 'children', {}).values():
+            if getattr(child, 'type', None) in PAYLOAD_TYPES:
+                name = getattr(child.proto, 'component_name', '') or child.type
+                name = f'{name}#{sum(key.split("#")[0] == name for key in sizes)}'
+                sizes[name] = len(child.proto.SerializeToString())
+            walk(child)
+    walk(at._tree)
+    return sizes
+
+
+#==============================================================================
+# Scenario
+#==============================================================================
+def run_scenario(map_mode=None, timeout=600):
+    """
+    This function runs the dashboard headlessly from the working directory
+    through every measured render path, and returns the measures of each step
+    """
+    from streamlit.testing.v1 import AppTest
+
+    steps = {}
+    def measure(name, at):
+        start = time.perf_counter()
+        at.run(timeout=timeout)
+        steps[name] = {
+            'seconds': round(time.perf_counter() - start, 4),
+            'max_rss_mb': max_rss_mb(),
+            'payload_bytes': payload_sizes(at),
+            'exceptions': [exception.message for exception in at.exception],
+        }
+
+    at = AppTest.from_file(DASHBOARD, default_timeout=timeout)
+    if map_mode is not None:
+        at.session_state['map_mode'] = map_mode
+    measure('cold_start', at)
+    measure('warm_rerun', at)
+
+    # Tab 1: change the year
+    years = at.selectbox(key='select_year1')
+    years.select(years.options[-1])
+    measure('tab1_year_change', at)
+
+    # Tab 2: first view, then the metric toggle
+    views = at.radio(key='view')
+    views.set_value(views.options[1])
+    measure('tab2_open', at)
+    metric = at.selectbox(key='event1')
+    metric.select_index(1)
+    measure('tab2_metric_toggle', at)
+
+    # Tab 3: every sub-tab
+    views = at.radio(key='view')
+    views.set_value(views.options[2])
+    measure('tab3_open', at)
+    for k, option in enumerate(at.radio(key='view3').options):
+        at.radio(key='view3').set_value(option)
+        measure(f'tab3_view{k + 1}', at)
+
+    return steps
+
+
+def run_worker(data_dir, scale, map_mode, timeout):
+    """
+    This function measures one scale of the dataset, from a fresh working
+    directory so that no cache or artifact is shared between runs
+    """
+    work_dir = tempfile.mkdtemp(prefix=f'benchmark-x{scale}-')
+    try:
+        dataset = prepare_data(data_dir, work_dir, scale)
+        os.chdir(work_dir)
+        sys.path.insert(0, REPO_DIR)
+        start_rss = max_rss_mb()
+        steps = run_scenario(map_mode, timeout)
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'scale': scale, 'map_mode': map_mode, **dataset, 'start_rss_mb': start_rss, 'steps': steps}
+
+
+#==============================================================================
+# Command line
+#==============================================================================
+def git_commit():
+    """
+    This function returns the commit of the benchmarked tree, if any
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """
+    This function runs the benchmark of every scale in its own process and
+    writes the results as JSON
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the render paths of the dashboard headlessly.')
+    parser.add_argument('--data-dir', default=REPO_DIR)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1])
+    parser.add_argument('--map-mode', default=None, help='map mode label, the dashboard default if omitted')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--output', default=OUTPUT_JSON)
+    parser.add_argument('--worker', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        result = run_worker(args.data_dir, args.worker, args.map_mode, args.timeout)
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(result, file)
+        return
+
+    import streamlit
+    runs = []
+    for scale in args.scales:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as result:
+            result_path = result.name
+        command = [sys.executable, os.path.abspath(__file__), '--worker', str(scale), '--data-dir', os.path.abspath(args.data_dir),
+                   '--timeout', str(args.timeout), '--output', result_path]
+        if args.map_mode is not None:
+            command += ['--map-mode', args.map_mode]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(result_path, encoding='utf-8') as file:
+            run = json.load(file)
+        os.remove(result_path)
+        runs.append(run)
+
+        print(f"x{scale}: {run['communes']} communes, {run['events']} events")
+        for name, step in run['steps'].items():
+            payload = sum(step['payload_bytes'].values())
+            errors = f"  {len(step['exceptions'])} exception(s)" if step['exceptions'] else ''
+            print(f"  {name:<20} {step['seconds']:>8.3f} s {step['max_rss_mb']:>8.1f} MB {payload / 1024:>9.1f} KB{errors}")
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'streamlit': streamlit.__version__,
+        'runs': runs,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
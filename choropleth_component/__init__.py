@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Style-only choropleth component
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import streamlit.components.v1 as components
+
+import risk_data
+import risk_maps as rm
+
+
+# The geometry files, pages and tiles are served by Streamlit from the
+# component directory, from the dashboard origin, compressed and with an
+# ETag. Each set of files is written once to DATA_DIR/<kind>-<hash>, named by
+# the hash of its content so that browsers can cache it. Only the STATIC_KEEP
+# most recently used sets of a kind are kept: the current one and the one
+# sessions may still show.
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend')
+DATA_DIR = os.path.join(FRONTEND_DIR, 'data')
+TILES_DIR = os.path.join(FRONTEND_DIR, 'tiles')
+STATIC_KEEP = 2
+
+# Number of palette colors shown in the legend gradient
+LEGEND_STEPS = 16
+PALETTE_STRIDE = rm.PALETTE_SIZE // LEGEND_STEPS
+
+_component = components.declare_component('choropleth', path=FRONTEND_DIR)
+
+
+#==============================================================================
+# Static files
+#==============================================================================
+def static_files(kind, files):
+    """
+    This function writes a set of files, by name, once to a directory named
+    by their hash, and prunes the older sets of the same kind. It returns the
+    URL of the directory relative to the component.
+    """
+    digest = hashlib.sha1()
+    for filename, content in sorted(files.items()):
+        digest.update(filename.encode('utf-8'))
+        digest.update(content)
+    name = f'{kind}-{digest.hexdigest()[:16]}'
+    path = os.path.join(DATA_DIR, name)
+
+    if os.path.isdir(path):
+        os.utime(path)
+    else:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(prefix=f'{name}.', suffix='.tmp', dir=DATA_DIR)
+        os.chmod(tmp_path, 0o755)
+        for filename, content in files.items():
+            with open(os.path.join(tmp_path, filename), 'wb') as file:
+                file.write(content)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Written meanwhile by another session
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    risk_data.prune_directories(DATA_DIR, STATIC_KEEP, prefix=f'{kind}-')
+    return f'data/{name}'
+
+
+def page_url(kind, html):
+    """
+    This function writes an HTML page as static files, and returns its URL
+    relative to the dashboard, for an iframe of the dashboard page
+    """
+    return f'component/{_component.name}/{static_files(kind, {"index.html": html.encode("utf-8")})}/index.html'
+
+
+#==============================================================================
+# Geometry
+#==============================================================================
+def geometry_json(gdf, fields):
+    """
+    This function returns the geometries and static properties of a
+    GeoDataFrame as GeoJSON. Each feature carries its row position 'i'.
+    """
+    features = rm.feature_collection(gdf.assign(i=np.arange(len(gdf))), ['i'] + fields)
+    return features.to_json(drop_id=True).encode('utf-8')
+
+
+def pyramid_files(communes, pyramid, fields):
+    """
+    This function writes one GeoJSON file per level of the geometry pyramid,
+    as a set of static files: .json, which Streamlit sends compressed.
+    Commune features carry the static fields; rollup features carry their
+    columns and the row positions of their communes in 'members', over which
+    the browser averages the values sent on every rerun.
+
+    It returns the levels, from the coarsest, with the zoom up to which each
+    one is shown (None for the last one), its URL and its tooltip labels.
+    """
+    levels, files = [], {}
+    for max_zoom, name, by, _ in risk_data.LOD_LEVELS + [(None, risk_data.FULL_LEVEL, None, None)]:
+        if by is None:
+            files[f'{name}.json'] = geometry_json(communes.set_geometry(pyramid[name].geometry.values), fields)
+            labels = []
+        else:
+            positions = communes[by].assign(members=np.arange(len(communes)))
+            members = positions.groupby(by, observed=True)['members'].apply(list)
+            files[f'{name}.json'] = geometry_json(pyramid[name].join(members, on=by), by + ['members'])
+            labels = [[column, rm.ROLLUP_ALIASES[column]] for column in by]
+        levels.append({'max_zoom': max_zoom, 'url': f'{name}.json', 'labels': labels})
+
+    directory = static_files('pyramid', files)
+    return [dict(level, url=f"{directory}/{level['url']}") for level in levels]
+
+
+def to_list(values):
+    """
+    This function converts an array to a JSON friendly list, NaN becoming null
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return np.where(np.isnan(values), None, values).tolist()
+    return values.tolist()
+
+
+#==============================================================================
+# Component
+#==============================================================================
+def choropleth(levels, colormap, values, columns, fields, aliases, selected=None, selected_bounds=None, footer=None, fill_opacity=0.8, height=600, key=None):
+    """
+    This function displays the geometry layers of pyramid_files() colored by
+    values. Only the palette indices, the legend and the tooltip columns are
+    sent on a rerun; the browser keeps the geometry layer and loads the
+    pyramid level matching its zoom.
+
+    Parameters
+    ----------
+    levels : levels returned by pyramid_files()
+    colormap : branca colormap of the values
+    values : value of every geometry row, NaN hides the row
+    columns : dict of the tooltip fields that change between reruns, each
+        aligned with the geometry rows. Other fields are read from the static
+        feature properties.
+    fields, aliases : tooltip fields and labels, in display order
+    selected : row position of a commune to highlight
+    selected_bounds : [[south, west], [north, east]] of the selected commune
+    footer : extra line of the selected commune popup
+
+    It returns the last point clicked, {'lat', 'lng', 'time'}, or None.
+    """
+    values = np.asarray(values, dtype=float)
+    palette, index = rm.color_index(colormap, values)
+    index = np.where(np.isnan(values), -1, index)
+
+    legend = {
+        'colors': palette[::PALETTE_STRIDE].tolist() + [palette[-1]],
+        'vmin': float(colormap.vmin),
+        'vmax': float(colormap.vmax),
+        'caption': colormap.caption,
+    }
+
+    return _component(
+        levels=levels,
+        palette=palette.tolist(),
+        colors=index.tolist(),
+        columns={field: to_list(column) for field, column in columns.items()},
+        fields=fields,
+        aliases=aliases,
+        legend=legend,
+        selected=None if selected is None else int(selected),
+        selected_bounds=selected_bounds,
+        footer=footer,
+        fill_opacity=fill_opacity,
+        center=rm.MAP_CENTER,
+        zoom=rm.MAP_ZOOM,
+        height=height,
+        key=key,
+        default=None,
+    )
+
+
+def vector_tiles(url, max_native_zoom, colormap, value_property, properties, aliases, selected=None, selected_bounds=None, popup=None, fill_opacity=0.8, height=600, key=None):
+    """
+    This function displays vector tiles colored by one of their feature
+    properties. Only the tile URL, the palette and the property names are
+    sent on a rerun; the browser loads the tiles of its view and colors them.
+
+    Parameters
+    ----------
+    url : tile URL template, with {z}, {x} and {y}
+    max_native_zoom : last zoom with tiles, which are overzoomed beyond
+    colormap : branca colormap of the values
+    value_property : feature property colored, a missing value hides the feature
+    properties, aliases : tooltip properties and labels, in display order
+    selected : row position 'i' of a commune to highlight
+    selected_bounds : [[south, west], [north, east]] of the selected commune
+    popup : HTML of the selected commune popup
+
+    It returns the last point clicked, {'lat', 'lng', 'time'}, or None.
+    """
+    palette, _ = rm.color_index(colormap, [])
+
+    legend = {
+        'colors': palette[::PALETTE_STRIDE].tolist() + [palette[-1]],
+        'vmin': float(colormap.vmin),
+        'vmax': float(colormap.vmax),
+        'caption': colormap.caption,
+    }
+
+    return _component(
+        tiles=url,
+        max_native_zoom=max_native_zoom,
+        palette=palette.tolist(),
+        value_property=value_property,
+        properties=properties,
+        aliases=aliases,
+        legend=legend,
+        selected=None if selected is None else int(selected),
+        selected_bounds=selected_bounds,
+        popup=popup,
+        fill_opacity=fill_opacity,
+        center=rm.MAP_CENTER,
+        zoom=rm.MAP_ZOOM,
+        height=height,
+        key=key,
+        default=None,
+    )
@@ -0,0 +1,316 @@
+// Mapbox Vector Tiles layer drawn on canvas tiles: a minimal reader of the
+// polygon tiles written by risk_tiles, styled per feature from its
+// properties. Zooms past maxDataZoom draw the tiles of that zoom scaled up.
+// Fires mouseover (with the hovered feature as event.layer) and mouseout.
+(function () {
+  // Protobuf reader of the wire types used by vector tiles
+  function Reader(buffer) {
+    this.buf = new Uint8Array(buffer);
+    this.view = new DataView(buffer);
+    this.pos = 0;
+  }
+
+  Reader.prototype.varint = function () {
+    var result = 0, shift = 1, byte;
+    do {
+      byte = this.buf[this.pos++];
+      result += (byte & 0x7f) * shift;
+      shift *= 128;
+    } while (byte >= 0x80);
+    return result;
+  };
+
+  Reader.prototype.zigzag = function () {
+    var value = this.varint();
+    return value % 2 === 1 ? -(value + 1) / 2 : value / 2;
+  };
+
+  Reader.prototype.string = function () {
+    var end = this.varint() + this.pos;
+    var value = new TextDecoder("utf-8").decode(this.buf.subarray(this.pos, end));
+    this.pos = end;
+    return value;
+  };
+
+  Reader.prototype.packed = function () {
+    var end = this.varint() + this.pos, values = [];
+    while (this.pos < end) {
+      values.push(this.varint());
+    }
+    return values;
+  };
+
+  Reader.prototype.skip = function (type) {
+    if (type === 0) {
+      this.varint();
+    } else if (type === 1) {
+      this.pos += 8;
+    } else if (type === 2) {
+      this.pos += this.varint();
+    } else if (type === 5) {
+      this.pos += 4;
+    }
+  };
+
+  function readValue(reader, end) {
+    var value = null;
+    while (reader.pos < end) {
+      var tag = reader.varint(), field = tag >> 3;
+      if (field === 1) {
+        value = reader.string();
+      } else if (field === 2) {
+        value = reader.view.getFloat32(reader.pos, true);
+        reader.pos += 4;
+      } else if (field === 3) {
+        value = reader.view.getFloat64(reader.pos, true);
+        reader.pos += 8;
+      } else if (field === 4 || field === 5) {
+        value = reader.varint();
+      } else if (field === 6) {
+        value = reader.zigzag();
+      } else if (field === 7) {
+        value = reader.varint() === 1;
+      } else {
+        reader.skip(tag & 7);
+      }
+    }
+    return value;
+  }
+
+  function readFeature(reader, end) {
+    var feature = {tags: [], geometry: []};
+    while (reader.pos < end) {
+      var tag = reader.varint(), field = tag >> 3;
+      if (field === 2) {
+        feature.tags = reader.packed();
+      } else if (field === 4) {
+        feature.geometry = reader.packed();
+      } else {
+        reader.skip(tag & 7);
+      }
+    }
+    return feature;
+  }
+
+  function readLayer(reader, end) {
+    var layer = {name: "", extent: 4096, keys: [], values: [], features: []};
+    while (reader.pos < end) {
+      var tag = reader.varint(), field = tag >> 3, length;
+      if (field === 1) {
+        layer.name = reader.string();
+      } else if (field === 2) {
+        length = reader.varint();
+        layer.features.push(readFeature(reader, reader.pos + length));
+      } else if (field === 3) {
+        layer.keys.push(reader.string());
+      } else if (field === 4) {
+        length = reader.varint();
+        layer.values.push(readValue(reader, reader.pos + length));
+      } else if (field === 5) {
+        layer.extent = reader.varint();
+      } else {
+        reader.skip(tag & 7);
+      }
+    }
+    return layer;
+  }
+
+  // Features of every layer of a tile, with their properties and their
+  // geometry commands scaled to a 0-1 tile
+  function readTile(buffer) {
+    var reader = new Reader(buffer), features = [];
+    while (reader.pos < reader.buf.length) {
+      var tag = reader.varint();
+      if (tag >> 3 !== 3) {
+        reader.skip(tag & 7);
+        continue;
+      }
+      var length = reader.varint();
+      var layer = readLayer(reader, reader.pos + length);
+      layer.features.forEach(function (feature) {
+        var properties = {};
+        for (var k = 0; k + 1 < feature.tags.length; k += 2) {
+          properties[layer.keys[feature.tags[k]]] = layer.values[feature.tags[k + 1]];
+        }
+        features.push({properties: properties, rings: decodeRings(feature.geometry, layer.extent)});
+      });
+    }
+    return features;
+  }
+
+  // Rings of a polygon geometry, as flat [x0, y0, x1, y1, ...] arrays
+  function decodeRings(geometry, extent) {
+    var rings = [], ring = null, x = 0, y = 0, k = 0;
+    while (k < geometry.length) {
+      var command = geometry[k] & 0x7, count = geometry[k] >> 3;
+      k++;
+      if (command === 7) {
+        ring = null;
+        continue;
+      }
+      for (var n = 0; n < count; n++) {
+        var dx = geometry[k++], dy = geometry[k++];
+        x += dx % 2 === 1 ? -(dx + 1) / 2 : dx / 2;
+        y += dy % 2 === 1 ? -(dy + 1) / 2 : dy / 2;
+        if (command === 1) {
+          ring = [];
+          rings.push(ring);
+        }
+        ring.push(x / extent, y / extent);
+      }
+    }
+    return rings;
+  }
+
+  L.VectorTiles = L.GridLayer.extend({
+    options: {maxDataZoom: 18, style: null},
+
+    initialize: function (url, options) {
+      this._url = url;
+      this._data = {};
+      this._hovered = null;
+      L.GridLayer.prototype.initialize.call(this, options);
+    },
+
+    onAdd: function (map) {
+      L.GridLayer.prototype.onAdd.call(this, map);
+      map.on("mousemove", this._onMouseMove, this);
+      map.on("mouseout", this._onMouseOut, this);
+    },
+
+    onRemove: function (map) {
+      map.off("mousemove", this._onMouseMove, this);
+      map.off("mouseout", this._onMouseOut, this);
+      L.GridLayer.prototype.onRemove.call(this, map);
+    },
+
+    // Features of a tile of the data zoom, read once; missing tiles are empty
+    _load: function (z, x, y) {
+      var key = z + "/" + x + "/" + y;
+      if (!(key in this._data)) {
+        var url = L.Util.template(this._url, {z: z, x: x, y: y});
+        this._data[key] = fetch(url).then(function (response) {
+          return response.ok ? response.arrayBuffer().then(readTile) : [];
+        }).catch(function () { return []; });
+      }
+      return this._data[key];
+    },
+
+    createTile: function (coords, done) {
+      var size = this.getTileSize(), ratio = window.devicePixelRatio || 1;
+      var canvas = L.DomUtil.create("canvas", "leaflet-tile");
+      canvas.width = size.x * ratio;
+      canvas.height = size.y * ratio;
+      canvas.style.width = size.x + "px";
+      canvas.style.height = size.y + "px";
+
+      // Part of the data tile covered by this tile
+      var shift = Math.max(coords.z - this.options.maxDataZoom, 0), scale = Math.pow(2, shift);
+      var x = coords.x >> shift, y = coords.y >> shift;
+      var offsetX = (coords.x - x * scale) * size.x, offsetY = (coords.y - y * scale) * size.y;
+
+      var layer = this;
+      this._load(coords.z - shift, x, y).then(function (features) {
+        canvas._features = features.map(function (feature) {
+          var path = new Path2D();
+          feature.rings.forEach(function (ring) {
+            for (var k = 0; k < ring.length; k += 2) {
+              var px = ring[k] * size.x * scale - offsetX, py = ring[k + 1] * size.y * scale - offsetY;
+              if (k === 0) {
+                path.moveTo(px, py);
+              } else {
+                path.lineTo(px, py);
+              }
+            }
+            path.closePath();
+          });
+          return {properties: feature.properties, path: path};
+        });
+        layer._draw(canvas);
+        done(null, canvas);
+      });
+      return canvas;
+    },
+
+    _draw: function (canvas) {
+      var ratio = window.devicePixelRatio || 1, style = this.options.style;
+      var context = canvas.getContext("2d");
+      context.setTransform(ratio, 0, 0, ratio, 0, 0);
+      context.clearRect(0, 0, canvas.width, canvas.height);
+      (canvas._features || []).forEach(function (feature) {
+        var options = style(feature.properties);
+        if (options.fill) {
+          context.globalAlpha = options.fillOpacity;
+          context.fillStyle = options.fillColor;
+          context.fill(feature.path, "evenodd");
+        }
+        if (options.stroke !== false && options.weight) {
+          context.globalAlpha = options.opacity;
+          context.strokeStyle = options.color;
+          context.lineWidth = options.weight;
+          context.stroke(feature.path);
+        }
+      });
+      context.globalAlpha = 1;
+    },
+
+    // Draws the tiles shown again, with the current style, and hovers the
+    // point under the mouse again for the new properties to be shown
+    restyle: function () {
+      for (var key in this._tiles) {
+        this._draw(this._tiles[key].el);
+      }
+      if (this._hovered) {
+        this._onMouseOut({latlng: this._latlng});
+        this._onMouseMove({latlng: this._latlng});
+      }
+    },
+
+    // Feature drawn under a point of the map, the last drawn first
+    _featureAt: function (latlng) {
+      var size = this.getTileSize(), zoom = this._tileZoom;
+      var point = this._map.project(latlng, zoom);
+      var coords = L.point(Math.floor(point.x / size.x), Math.floor(point.y / size.y));
+      coords.z = zoom;
+      var tile = this._tiles[this._tileCoordsToKey(coords)];
+      if (!tile || !tile.el._features) {
+        return null;
+      }
+      var ratio = window.devicePixelRatio || 1, style = this.options.style;
+      var x = (point.x - coords.x * size.x) * ratio, y = (point.y - coords.y * size.y) * ratio;
+      var context = tile.el.getContext("2d"), features = tile.el._features;
+      for (var k = features.length - 1; k >= 0; k--) {
+        if (style(features[k].properties).fill && context.isPointInPath(features[k].path, x, y, "evenodd")) {
+          return features[k];
+        }
+      }
+      return null;
+    },
+
+    _onMouseMove: function (event) {
+      var feature = this._featureAt(event.latlng);
+      this._latlng = event.latlng;
+      if (feature === this._hovered) {
+        return;
+      }
+      if (this._hovered) {
+        this.fire("mouseout", {layer: this._hovered, latlng: event.latlng});
+      }
+      this._hovered = feature;
+      if (feature) {
+        this.fire("mouseover", {layer: feature, latlng: event.latlng});
+      }
+    },
+
+    _onMouseOut: function (event) {
+      if (this._hovered) {
+        this.fire("mouseout", {layer: this._hovered, latlng: event.latlng});
+        this._hovered = null;
+      }
+    }
+  });
+
+  L.vectorTiles = function (url, options) {
+    return new L.VectorTiles(url, options);
+  };
+})();
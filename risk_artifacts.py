@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Pre-rendered maps
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import os
+import gzip
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import shapely
+
+import risk_data
+import risk_maps as rm
+
+
+# Pre-rendered maps are written gzip compressed at ARTIFACT_LEVEL to
+# ARTIFACT_DIR/<key>.html.gz, the key being a hash of every input of the map;
+# past ARTIFACT_BYTES the least recently served maps are removed
+ARTIFACT_DIR = 'artifacts'
+ARTIFACT_BYTES = 256 * 1024 ** 2
+ARTIFACT_LEVEL = 6
+
+# Part of every key, to be bumped when the rendering of the maps changes
+ARTIFACT_FORMAT = 1
+
+# Id of the map in the pre-rendered HTML, whose Leaflet map is map_<id>
+ARTIFACT_MAP_ID = 'previrisque'
+
+
+#==============================================================================
+# Variants
+#==============================================================================
+def risk_map_args(communes, cube, year_index):
+    """
+    This function returns the inputs of the risk map of a year
+    """
+    year = cube['years'][year_index]
+    aliases = [
+        'INSEE:', 'Commune:',
+        f'Risque Inondations et/ou coulées de boue ({year}):',
+        f'Risque Inondations remontée nappe ({year}):',
+        f'Risque Sécheresse ({year}):',
+        'Risque Historique:', 'Risque Moyen:',
+    ]
+    return {
+        'gdf': risk_data.risk_frame(communes, cube, year_index),
+        'value_column': 'average_risk',
+        'colormap': rm.make_colormap(rm.RISK_COLORS, cube['bounds'][year_index], caption=f'{year} - {rm.RISK_SCALE}'),
+        'fields': rm.RISK_TOOLTIP,
+        'aliases': aliases,
+        'fill_opacity': 0.8,
+    }
+
+
+def event_map_args(communes, aggregates, peril, metric_index):
+    """
+    This function returns the inputs of the event map of a peril and metric
+    """
+    column, label = rm.EVENT_METRICS[peril][metric_index]
+    gdf = risk_data.event_frame(communes, aggregates)
+    return {
+        'gdf': gdf,
+        'value_column': column,
+        'colormap': rm.make_colormap(rm.EVENT_COLORS[peril], gdf[column], caption=label),
+        'fields': ['Commune', column],
+        'aliases': ['Commune:', f'{label}:'],
+        'fill_opacity': 1,
+    }
+
+
+def map_variants(communes, cube, aggregates):
+    """
+    This function yields the name and inputs of every map of the dashboard:
+    the risk map of each year, and the event map of each peril and metric
+    """
+    for year_index, year in enumerate(cube['years']):
+        yield f'risk_{year}', risk_map_args(communes, cube, year_index)
+    for peril, metrics in rm.EVENT_METRICS.items():
+        for metric_index, (column, _) in enumerate(metrics):
+            yield f'{peril}_{column}', event_map_args(communes, aggregates[peril], peril, metric_index)
+
+
+#==============================================================================
+# Rendering
+#==============================================================================
+def artifact_key(gdf, value_column, colormap, fields, aliases, fill_opacity, version):
+    """
+    This function hashes the inputs of a map: its columns, colors and labels,
+    and the version of the commune geometries
+    """
+    spec = [ARTIFACT_FORMAT, version, value_column, fields, aliases, fill_opacity,
+            [list(color) for color in colormap.colors], float(colormap.vmin), float(colormap.vmax), colormap.caption]
+    digest = hashlib.sha1(json.dumps(spec, default=str).encode('utf-8'))
+    columns = list(dict.fromkeys(fields + [value_column]))
+    digest.update(pd.util.hash_pandas_object(gdf[columns], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def render_artifact(gdf, value_column, colormap, fields, aliases, fill_opacity, pyramid):
+    """
+    This function renders a map as a standalone HTML page, in the default view
+    """
+    m = rm.choropleth_map(gdf, value_column, colormap, fields, aliases, pyramid, fill_opacity=fill_opacity)
+    m._id = ARTIFACT_MAP_ID
+    return m.get_root().render()
+
+
+def select_commune(html, geometry, popup, zoom):
+    """
+    This function adds to a pre-rendered map the highlight of a commune, with
+    its popup, and centers the map on it
+    """
+    center = geometry.centroid
+    name = f'map_{ARTIFACT_MAP_ID}'
+    script = (
+        '<script>'
+        f"L.geoJSON({shapely.to_geojson(geometry)}, {{style: {{fillColor: 'orange', color: 'black', weight: 0.5, fillOpacity: 0.6}}}}).addTo({name});"
+        f'L.marker([{center.y}, {center.x}]).bindPopup({json.dumps(popup)}, {{maxWidth: 300}}).addTo({name}).openPopup();'
+        f'{name}.setView([{center.y}, {center.x}], {zoom});'
+        '</script>'
+    )
+    head, end, tail = html.rpartition('</html>')
+    return head + script + end + tail
+
+
+#==============================================================================
+# Cache
+#==============================================================================
+class ArtifactCache:
+    """
+    Disk cache of pre-rendered maps, gzip compressed and keyed by the hash of
+    their inputs. Serving a map marks it as used, and the least recently used
+    maps are removed past max_bytes.
+    """
+
+    def __init__(self, directory=ARTIFACT_DIR, max_bytes=ARTIFACT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        """
+        This method returns the file of a map
+        """
+        return os.path.join(self.directory, f'{key}.html.gz')
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key):
+        """
+        This method returns the HTML of a map, None when it is not cached
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return gzip.decompress(data).decode('utf-8')
+
+    def put(self, key, html):
+        """
+        This method writes the HTML of a map atomically, then evicts the least
+        recently used maps
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(gzip.compress(html.encode('utf-8'), compresslevel=ARTIFACT_LEVEL))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        This method removes the least recently used maps until the cache fits
+        in max_bytes
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.html.gz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+#==============================================================================
+# Build
+#==============================================================================
+_pyramid = None
+
+
+def init_worker():
+    """
+    This function loads the geometry pyramid once per build process
+    """
+    global _pyramid
+    _pyramid = risk_data.load_pyramid(risk_data.load_communes())
+
+
+def build_artifact(cache, key, args):
+    """
+    This function renders a map into the cache, and returns the seconds taken
+    """
+    start = time.perf_counter()
+    cache.put(key, render_artifact(pyramid=_pyramid, **args))
+    return time.perf_counter() - start
+
+
+def build_artifacts(directory=ARTIFACT_DIR, max_bytes=ARTIFACT_BYTES, workers=None, force=False):
+    """
+    This function pre-renders every map of the dashboard in parallel, over a
+    pool of processes. Maps whose inputs did not change are already cached
+    and are not rendered again, unless forced.
+
+    It returns the name, key and rendering seconds of every map, None for the
+    maps already cached.
+    """
+    communes = risk_data.load_communes()
+    risk_data.load_pyramid(communes)
+    cube = risk_data.load_risk_cube(communes)
+    aggregates = risk_data.event_store(communes).refresh()['aggregates']
+    version = risk_data.file_fingerprint(risk_data.INSEE_CSV)
+    cache = ArtifactCache(directory, max_bytes)
+
+    results, pending = [], {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        for name, args in map_variants(communes, cube, aggregates):
+            key = artifact_key(**args, version=version)
+            if key in cache and not force:
+                results.append((name, key, None))
+            else:
+                pending[name] = (key, pool.submit(build_artifact, cache, key, args))
+        for name, (key, future) in pending.items():
+            results.append((name, key, future.result()))
+    return results
+
+
+#==============================================================================
+# Command line
+#==============================================================================
+def main():
+    """
+    This function pre-renders the maps of the dashboard into the cache
+    """
+    parser = argparse.ArgumentParser(description='Pre-render the maps of the dashboard.')
+    parser.add_argument('--directory', default=ARTIFACT_DIR)
+    parser.add_argument('--max-mb', type=float, default=ARTIFACT_BYTES / 1024 ** 2)
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, one per core if omitted')
+    parser.add_argument('--force', action='store_true', help='render the maps already cached again')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for name, key, seconds in build_artifacts(args.directory, int(args.max_mb * 1024 ** 2), args.workers, args.force):
+        print(f"{name:<28} {key[:16]}  {'cached' if seconds is None else f'{seconds:.2f} s'}")
+    print(f'Built in {time.perf_counter() - start:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1028 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Data store
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import io
+import os
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import functools
+import threading
+import collections
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+
+# Commune geometries: CSV source and pre-parsed binary artifact
+INSEE_CSV = 'insee_df.csv'
+INSEE_PARQUET = 'insee_df.parquet'
+INSEE_COLUMNS = ['Code INSEE', 'Commune', 'Code Département', 'Code Canton', 'geometry']
+CRS = 'EPSG:4326'
+
+# Typed schema of the loaded tables: INSEE, département and canton codes are
+# categoricals of their text, which keeps their leading zeros and the Corsican
+# codes (2A, 2B); other labels are categoricals, predictions float32 and
+# dates datetime64 parsed at read time. Columns not listed are not read.
+# The INSEE codes of the loaded communes and of the event store share one
+# categorical dtype, whose categories are the codes of the commune table in
+# its order, see commune_dtype(): their categorical code is the commune id,
+# the row position of the commune, on which tables are joined.
+COMMUNE_CODE = 'category'
+COMMUNE_DTYPES = {'Code INSEE': COMMUNE_CODE, 'Commune': 'category', 'Code Département': COMMUNE_CODE, 'Code Canton': COMMUNE_CODE}
+PREDICTION_DTYPE = 'float32'
+EVENT_COLUMNS = ['cod_nat_catnat', 'cod_commune', 'lib_commune', 'lib_risque_jo', 'dat_deb', 'dat_fin', 'dat_maj']
+EVENT_DTYPES = {'cod_nat_catnat': 'category', 'cod_commune': COMMUNE_CODE, 'lib_commune': 'category', 'lib_risque_jo': 'category'}
+EVENT_DATES = ['dat_deb', 'dat_fin', 'dat_maj']
+
+# Geometry pyramid: each level is shown up to a zoom. The two coarsest levels
+# are rollups dissolved by the given columns, the others are the communes.
+# Tolerances of the coverage simplification are in degrees, about one pixel.
+# Above the last zoom the communes are shown at full resolution.
+LOD_PARQUET = 'insee_lod.parquet'
+LOD_LEVELS = [
+    (6, 'departements', ['Code Département'], 0.022),
+    (7, 'cantons', ['Code Département', 'Code Canton'], 0.011),
+    (8, 'communes_z8', None, 0.0055),
+    (9, 'communes_z9', None, 0.0027),
+    (10, 'communes_z10', None, 0.0014),
+    (11, 'communes_z11', None, 0.0007),
+]
+FULL_LEVEL = 'communes'
+
+# Number of communes returned by a search
+SEARCH_LIMIT = 20
+
+# Prediction, historical and event sources
+PREDICTION_CSVS = {'coul': 'coul_predictions.csv', 'rem': 'rem_predictions.csv', 'sech': 'sech_predictions.csv'}
+HISTORICAL_CSV = 'historical_risk.csv'
+EVENT_CSVS = {'inon': 'inon_events.csv', 'sech': 'sech_events.csv'}
+SOIL_HTML = 'sol_map.html'
+SOURCES = {'insee': INSEE_CSV, **PREDICTION_CSVS, 'historical': HISTORICAL_CSV, **{f'{name}_events': path for name, path in EVENT_CSVS.items()},
+           'soil': SOIL_HTML}
+
+# Columns every CSV source must have, checked from its header before it is
+# read; each prediction CSV also needs a column of its prefix, and the soil
+# map only has to be present. The commune CSV is not needed once its
+# artifact is built.
+SOURCE_COLUMNS = {
+    'insee': INSEE_COLUMNS,
+    **{peril: ['Code INSEE'] for peril in PREDICTION_CSVS},
+    'historical': ['Code INSEE', 'normalized_historical_risk_score'],
+    **{f'{name}_events': EVENT_COLUMNS for name in EVENT_CSVS},
+}
+SOURCE_ARTIFACTS = {'insee': INSEE_PARQUET}
+
+# A period of an arrêté is identified by its CatNat code, commune, peril and
+# start date, an arrêté covering several periods of a commune; its rows with
+# the latest update date replace the older ones
+EVENT_KEY = ['cod_nat_catnat', 'cod_commune', 'lib_risque_jo', 'dat_deb']
+
+# The event store holds the rows of every event CSV sorted by peril, in this
+# order, then by start date. The perils of each view are consecutive, so that
+# the events of a view are a slice of the store. cat_events.csv holds the
+# rows of both CSVs starting after 2000, the 'cat' view, and is not read.
+EVENT_PERILS = ['Inondations et/ou coulées de boue', 'Inondations remontée nappe', 'Sécheresse']
+EVENT_VIEWS = {'inon': EVENT_PERILS[:2], 'sech': EVENT_PERILS[2:], 'cat': EVENT_PERILS}
+
+# Bytes of an event CSV hashed at once to tell that rows were only appended
+# to it
+DIGEST_CHUNK_BYTES = 1 << 20
+
+# Perils of the risk cube, and the prediction column prefix of each one
+PERILS = ['coul', 'rem', 'sech', 'historical']
+PREDICTION_PREFIXES = {'coul': 'event_intensity_coul_', 'rem': 'event_intensity_rem_', 'sech': 'event_intensity_sech_'}
+
+# Default window and size of the cumulative top communes charts
+TOP_START = '1995-01-01'
+TOP_END = '2023-12-31'
+TOP_N = 10
+
+# CatNat perils of the event count chart, counted after CATNAT_AFTER
+CATNAT_PERILS = ['Sécheresse', 'Inondations et/ou coulées de boue', 'Inondations remontée nappe']
+CATNAT_AFTER = 2000
+
+
+#==============================================================================
+# Artifacts
+#==============================================================================
+def is_stale(artifact_path, source_path):
+    """
+    This function tells whether an artifact is missing or older than its source
+    """
+    if not os.path.exists(artifact_path):
+        return True
+    if not os.path.exists(source_path):
+        return False
+    return os.path.getmtime(artifact_path) < os.path.getmtime(source_path)
+
+
+def write_parquet(gdf, path):
+    """
+    This function writes a GeoDataFrame atomically, so that concurrent
+    sessions never read a half written file
+    """
+    tmp_path = f'{path}.tmp'
+    gdf.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def prune_directories(directory, keep, prefix=''):
+    """
+    This function removes the sub-directories of a directory starting with a
+    prefix but the keep most recently used ones, by modification time;
+    directories being written, ending with .tmp, are left alone
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_dir() and entry.name.startswith(prefix) and not entry.name.endswith('.tmp'):
+            try:
+                entries.append((entry.stat().st_mtime_ns, entry.path))
+            except FileNotFoundError:
+                continue
+    for _, path in sorted(entries, reverse=True)[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def freeze(data):
+    """
+    This function makes the arrays of shared data read-only, in place, so
+    that an attempt to write to them raises instead of changing the data of
+    every session. It returns the data.
+    """
+    if isinstance(data, np.ndarray):
+        data.flags.writeable = False
+    elif isinstance(data, dict):
+        for value in data.values():
+            freeze(value)
+    elif isinstance(data, (list, tuple)):
+        for value in data:
+            freeze(value)
+    return data
+
+
+def file_fingerprint(path):
+    """
+    This function returns the (mtime, size) fingerprint of a file, None when
+    it is missing
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def source_fingerprints(sources=SOURCES):
+    """
+    This function returns the fingerprint of every data source, by name
+    """
+    return {name: file_fingerprint(path) for name, path in sources.items()}
+
+
+#==============================================================================
+# Sources
+#==============================================================================
+def check_source(name, path):
+    """
+    This function checks that a source is present and that its header holds
+    the columns its loader reads. It returns the problem found, None for a
+    valid source.
+    """
+    if not os.path.exists(path):
+        return None if os.path.exists(SOURCE_ARTIFACTS.get(name, '')) else 'missing file'
+    if os.path.getsize(path) == 0:
+        return 'empty file'
+    if name not in SOURCE_COLUMNS:
+        return None
+    try:
+        header = pd.read_csv(path, nrows=0).columns
+    except (ValueError, UnicodeDecodeError) as error:
+        return f'unreadable header ({error})'
+    missing = [column for column in SOURCE_COLUMNS[name] if column not in header]
+    if name in PREDICTION_PREFIXES and not any(column.startswith(PREDICTION_PREFIXES[name]) for column in header):
+        missing.append(f'{PREDICTION_PREFIXES[name]}<year>')
+    return f"missing columns {', '.join(missing)}" if missing else None
+
+
+def check_sources(sources=SOURCES):
+    """
+    This function checks every source, and returns the problem of each
+    invalid one, by name
+    """
+    problems = {name: check_source(name, path) for name, path in sources.items()}
+    return {name: problem for name, problem in problems.items() if problem is not None}
+
+
+def load_concurrently(loaders, workers=None, initializer=None):
+    """
+    This function runs loaders concurrently over a pool of threads. Reading
+    and parsing the CSVs mostly release the GIL, so that loading takes about
+    as long as the slowest loader rather than the sum of them. Each thread
+    first runs the initializer, if any.
+
+    It returns the result and report of each loader, by name. A report holds
+    the seconds the loader took and the exception it raised, if any, its
+    result being None.
+    """
+    def run(loader):
+        start = time.perf_counter()
+        try:
+            result, error = loader(), None
+        except Exception as exc:
+            result, error = None, exc
+        return result, {'seconds': time.perf_counter() - start, 'error': error}
+
+    with ThreadPoolExecutor(max_workers=workers or max(len(loaders), 1), initializer=initializer) as pool:
+        futures = {name: pool.submit(run, loader) for name, loader in loaders.items()}
+    runs = {name: future.result() for name, future in futures.items()}
+    return {name: result for name, (result, _) in runs.items()}, {name: report for name, (_, report) in runs.items()}
+
+
+#==============================================================================
+# Communes
+#==============================================================================
+def build_communes(csv_path=INSEE_CSV, parquet_path=INSEE_PARQUET):
+    """
+    This function parses the WKT geometries of the commune CSV once and writes
+    the used columns as GeoParquet (WKB geometries)
+    """
+    df = pd.read_csv(csv_path, usecols=INSEE_COLUMNS, dtype=COMMUNE_DTYPES)[INSEE_COLUMNS]
+    geometry = gpd.GeoSeries.from_wkt(df.pop('geometry'), crs=CRS)
+    gdf = gpd.GeoDataFrame(df, geometry=geometry)
+    if parquet_path is not None:
+        write_parquet(gdf, parquet_path)
+    return gdf
+
+
+def load_communes(csv_path=INSEE_CSV, parquet_path=INSEE_PARQUET):
+    """
+    This function loads the commune geometries from the GeoParquet artifact,
+    rebuilding it from the CSV when it is missing, outdated or has another
+    schema
+    """
+    gdf = None
+    if not is_stale(parquet_path, csv_path):
+        # The geometry is decoded with a known CRS rather than through
+        # gpd.read_parquet, whose PROJJSON parsing dominates the load time
+        df = pd.read_parquet(parquet_path)
+        if list(df.columns) == INSEE_COLUMNS and all(str(df[column].dtype) == dtype for column, dtype in COMMUNE_DTYPES.items()):
+            geometry = gpd.GeoSeries.from_wkb(df.pop('geometry'), crs=CRS)
+            gdf = gpd.GeoDataFrame(df, geometry=geometry)
+    if gdf is None:
+        gdf = build_communes(csv_path, parquet_path)
+    gdf['Code INSEE'] = commune_codes(gdf['Code INSEE'], commune_dtype(gdf['Code INSEE']))
+    return gdf
+
+
+def commune_dtype(codes):
+    """
+    This function returns the categorical dtype of the commune codes, whose
+    categories are the codes in the order of the commune table: the
+    categorical code of a commune is its commune id
+    """
+    return pd.CategoricalDtype(np.asarray(codes, dtype=str))
+
+
+def commune_codes(codes, dtype):
+    """
+    This function returns codes as a categorical of the commune dtype, NaN for
+    the codes of no commune. A categorical is mapped through its categories
+    only. Unlike astype, which takes categoricals of the same categories in
+    another order as already converted, it always recodes them.
+    """
+    return pd.Series(codes, dtype='category').cat.set_categories(dtype.categories)
+
+
+def commune_ids(codes, dtype):
+    """
+    This function returns the commune ids of the given codes, -1 for the
+    codes of no commune
+    """
+    return commune_codes(codes, dtype).cat.codes.to_numpy().astype('int32')
+
+
+#==============================================================================
+# Geometry pyramid
+#==============================================================================
+def lod_level(zoom):
+    """
+    This function returns the name of the pyramid level shown at a zoom
+    """
+    for max_zoom, name, _, _ in LOD_LEVELS:
+        if zoom <= max_zoom:
+            return name
+    return FULL_LEVEL
+
+
+def rollup_columns(level):
+    """
+    This function returns the columns a level is dissolved by, None for the
+    commune levels
+    """
+    return {name: by for _, name, by, _ in LOD_LEVELS}.get(level)
+
+
+def build_pyramid(communes, parquet_path=LOD_PARQUET):
+    """
+    This function simplifies the commune coverage at every tolerance of
+    LOD_LEVELS and dissolves the rollups. Shared borders are simplified once
+    for both neighbours, so no gap opens between communes.
+    """
+    frames = []
+    for _, name, by, tolerance in LOD_LEVELS:
+        if by is None:
+            level = communes[['Code INSEE', 'Code Département', 'Code Canton']].copy()
+            geometry = shapely.coverage_simplify(communes.geometry.values, tolerance)
+        else:
+            rollup = communes[by + ['geometry']].dissolve(by=by, method='coverage', as_index=False, observed=True)
+            level = rollup[by]
+            geometry = shapely.coverage_simplify(rollup.geometry.values, tolerance)
+        frames.append(level.assign(level=name, geometry=shapely.to_wkb(geometry)))
+
+    pyramid = pd.concat(frames, ignore_index=True)
+    for column in ['Code INSEE', 'Code Département', 'Code Canton']:
+        pyramid[column] = pyramid[column].astype(COMMUNE_CODE)
+    if parquet_path is not None:
+        pyramid.to_parquet(f'{parquet_path}.tmp', index=False)
+        os.replace(f'{parquet_path}.tmp', parquet_path)
+    return pyramid
+
+
+def load_pyramid(communes, csv_path=INSEE_CSV, parquet_path=LOD_PARQUET):
+    """
+    This function loads the geometry pyramid, rebuilding it when it is missing,
+    older than the commune CSV or keyed with another schema.
+
+    It returns a dict of level name to GeoDataFrame. The commune levels are
+    aligned with the rows of communes; the rollups hold their columns.
+    """
+    pyramid = None if is_stale(parquet_path, csv_path) else pd.read_parquet(parquet_path)
+    if pyramid is None or str(pyramid['Code INSEE'].dtype) != COMMUNE_CODE:
+        pyramid = build_pyramid(communes, parquet_path)
+
+    levels = {FULL_LEVEL: communes}
+    for name, level in pyramid.groupby('level', sort=False):
+        geometry = gpd.GeoSeries.from_wkb(level.pop('geometry').to_numpy(), crs=CRS)
+        level = gpd.GeoDataFrame(level.drop(columns='level').reset_index(drop=True), geometry=geometry)
+        by = rollup_columns(name)
+        if by is None:
+            ids = commune_ids(level['Code INSEE'], communes['Code INSEE'].dtype)
+            level = level[ids >= 0].set_axis(ids[ids >= 0]).reindex(np.arange(len(communes)))
+            level['Code INSEE'] = communes['Code INSEE'].values
+        else:
+            level = level.dropna(axis=1, how='all')
+            level[by] = level[by].apply(lambda column: column.cat.remove_unused_categories())
+        levels[name] = level
+    return levels
+
+
+#==============================================================================
+# Commune index
+#==============================================================================
+def normalize_name(text):
+    """
+    This function folds the case, accents and separators of a commune name or
+    code, for search
+    """
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(text.casefold().replace('-', ' ').replace("'", ' ').split())
+
+
+def build_commune_index(communes):
+    """
+    This function indexes the communes once for click-to-identify and search.
+    Every word of a name starts a search key, so that 'ascq' finds
+    Villeneuve-d'Ascq.
+
+    It returns a dict with:
+        - tree: STRtree of the commune geometries
+        - bounds: [[south, west], [north, east]] of every commune
+        - keys: the sorted search keys, normalized names and INSEE codes
+        - positions: the row position of the commune of each key
+    """
+    geometry = communes.geometry.values
+    bounds = shapely.bounds(geometry)
+
+    # Keys starting inside a name sort after the names equal to them
+    keys, inner, positions = [], [], []
+    for position, (name, code) in enumerate(zip(communes['Commune'], communes['Code INSEE'])):
+        words = normalize_name(name).split()
+        for k in range(len(words)):
+            keys.append(' '.join(words[k:]))
+            inner.append(k > 0)
+            positions.append(position)
+        keys.append(normalize_name(code))
+        inner.append(False)
+        positions.append(position)
+
+    keys = np.array(keys)
+    order = np.lexsort((positions, inner, keys))
+    return {
+        'tree': shapely.STRtree(geometry),
+        'bounds': np.stack([bounds[:, [1, 0]], bounds[:, [3, 2]]], axis=1),
+        'keys': keys[order],
+        'positions': np.array(positions)[order],
+    }
+
+
+def locate_commune(index, lon, lat):
+    """
+    This function returns the row position of the commune containing a point,
+    None outside every commune
+    """
+    hits = index['tree'].query(shapely.Point(lon, lat), predicate='intersects')
+    return int(hits.min()) if len(hits) else None
+
+
+def search_communes(index, text, mask=None, limit=SEARCH_LIMIT):
+    """
+    This function returns the row positions of the communes whose name, one of
+    its words or INSEE code starts with the text, shortest match first.
+    A boolean mask aligned with the communes restricts the results.
+    """
+    prefix = normalize_name(text)
+    if not prefix:
+        return []
+    keys = index['keys']
+    start = np.searchsorted(keys, prefix, side='left')
+    end = np.searchsorted(keys, prefix + '\uffff', side='left')
+
+    results = []
+    for position in index['positions'][start:end]:
+        if (mask is None or mask[position]) and position not in results:
+            results.append(int(position))
+            if len(results) == limit:
+                break
+    return results
+
+
+#==============================================================================
+# Predictions
+#==============================================================================
+def load_predictions(path):
+    """
+    This function reads a prediction CSV, with float32 predictions
+    """
+    return pd.read_csv(path, dtype=collections.defaultdict(lambda: PREDICTION_DTYPE, {'Code INSEE': COMMUNE_CODE}))
+
+
+def load_historical(path=HISTORICAL_CSV):
+    """
+    This function reads the historical risk scores, one per commune
+    """
+    historical = pd.read_csv(path, dtype={'Code INSEE': COMMUNE_CODE, 'normalized_historical_risk_score': PREDICTION_DTYPE})
+    return historical.groupby('Code INSEE', observed=True).first().reset_index()
+
+
+def load_soil_map(path=SOIL_HTML):
+    """
+    This function reads the soil map page
+    """
+    with open(path, encoding='utf-8') as file:
+        return file.read()
+
+
+#==============================================================================
+# Risk cube
+#==============================================================================
+def prediction_years(predictions, prefix):
+    """
+    This function lists the years of the prediction columns with a given prefix
+    """
+    return [col[len(prefix):] for col in predictions.columns if col.startswith(prefix)]
+
+
+def align(df, codes, columns):
+    """
+    This function reorders the given columns of a frame keyed by 'Code INSEE'
+    to the order of the commune codes by their commune ids, with NaN for the
+    missing communes
+    """
+    df = df.drop_duplicates('Code INSEE')
+    ids = commune_ids(df['Code INSEE'], codes.dtype)
+    values = np.full((len(codes), len(columns)), np.nan)
+    values[ids[ids >= 0]] = df[columns].to_numpy(dtype=float)[ids >= 0]
+    return values
+
+
+def build_risk_cube(codes, coul, rem, sech, historical):
+    """
+    This function builds the dense risk cube indexed by commune x peril x year,
+    aligned to the given commune codes. The historical score has no year and
+    is repeated over the years.
+
+    It returns a dict with:
+        - years: the prediction years
+        - values: the rounded risks, shape (communes, perils, years)
+        - average: the average risk, shape (communes, years)
+        - complete: the communes with a value for every peril
+        - bounds: the (min, max) of the average risk of each year
+    """
+    years = prediction_years(coul, PREDICTION_PREFIXES['coul'])
+
+    values = np.empty((len(codes), len(PERILS), len(years)))
+    for i, (peril, predictions) in enumerate(zip(PERILS, [coul, rem, sech])):
+        columns = [f'{PREDICTION_PREFIXES[peril]}{year}' for year in years]
+        values[:, i, :] = align(predictions, codes, columns).round(4)
+    values[:, PERILS.index('historical'), :] = align(historical, codes, ['normalized_historical_risk_score']).round(4)
+
+    complete = ~np.isnan(values).any(axis=(1, 2))
+    average = values.mean(axis=1).round(4)
+    bounds = np.stack([average[complete].min(axis=0), average[complete].max(axis=0)], axis=1)
+
+    return {'years': years, 'values': values, 'average': average, 'complete': complete, 'bounds': bounds}
+
+
+def load_risk_cube(communes):
+    """
+    This function reads the predictions and historical scores and builds the
+    risk cube of the communes
+    """
+    predictions = [load_predictions(PREDICTION_CSVS[peril]) for peril in ['coul', 'rem', 'sech']]
+    return build_risk_cube(communes['Code INSEE'], *predictions, load_historical())
+
+
+def risk_frame(communes, cube, year_index):
+    """
+    This function slices the risks of a year from the risk cube of the
+    communes; communes without every risk get no average risk
+    """
+    risks = cube['values'][:, :, year_index]
+    return communes.assign(
+        risk_coul=risks[:, 0],
+        risk_rem=risks[:, 1],
+        risk_sech=risks[:, 2],
+        normalized_historical_risk_score=risks[:, 3],
+        average_risk=np.where(cube['complete'], cube['average'][:, year_index], np.nan),
+    )
+
+
+#==============================================================================
+# Event aggregates
+#==============================================================================
+def typed_events(events, commune_dtype):
+    """
+    This function applies the event schema to a table, whose categoricals
+    may have been merged into objects, with the commune codes in the commune
+    dtype and the perils in the store order, and adds the duration of each
+    event in days
+    """
+    events = events.astype(EVENT_DTYPES)
+    events['cod_commune'] = commune_codes(events['cod_commune'], commune_dtype)
+    perils = events['lib_risque_jo'].cat.categories
+    events['lib_risque_jo'] = events['lib_risque_jo'].cat.set_categories(EVENT_PERILS + sorted(set(perils) - set(EVENT_PERILS)))
+    events['duration'] = ((events['dat_fin'] - events['dat_deb']).dt.days + 1).astype('float32')
+    return events
+
+
+def latest_arretes(events):
+    """
+    This function keeps the rows of each arrêté period with its latest
+    update date, the periods of communes out of the commune table included
+    """
+    version = events['dat_maj'].fillna(pd.Timestamp.min)
+    latest = version.groupby([events[column] for column in EVENT_KEY], observed=True, dropna=False).transform('max')
+    return events[version == latest]
+
+
+def event_totals(events):
+    """
+    This function computes the additive totals of an event table from which
+    event_aggregates() derives every aggregate: the events and durations per
+    commune, the events per month and per commune and date
+    """
+    by_commune = events.groupby('cod_commune', observed=True)
+    return {
+        'event_count': by_commune.size(),
+        'duration_sum': by_commune['duration'].sum().astype(float),
+        'duration_count': by_commune['duration'].count(),
+        'monthly': events.groupby(events['dat_deb'].dt.month.rename('month')).size(),
+        'commune_dates': events.groupby(['lib_commune', 'dat_deb'], observed=True).size(),
+    }
+
+
+def combine_totals(totals, other, sign=1):
+    """
+    This function adds (or subtracts with sign=-1) the totals of two event
+    tables, dropping the entries left empty
+    """
+    combined = {}
+    for name, total in totals.items():
+        total = total.add(sign * other[name], fill_value=0)
+        combined[name] = total[total != 0].sort_index()
+    return combined
+
+
+def commune_date_index(commune_dates):
+    """
+    This function indexes the events per commune and date for window
+    queries. Entries are sorted by commune and date, and keyed by both so
+    that the entries of any commune and window are found with searchsorted;
+    the running total of their events gives the events of a range of entries
+    by a difference.
+
+    It returns a dict with:
+        - communes: the sorted commune names
+        - dates: the date of each entry
+        - events: the events of each entry
+        - keys: the commune and day key of each entry
+        - running: the running total of the events, starting at 0
+        - first, span: the first day and the number of days, that keys are
+          relative to
+    """
+    labels = commune_dates.index.get_level_values('lib_commune').astype(str).to_numpy()
+    dates = commune_dates.index.get_level_values('dat_deb').to_numpy().astype('datetime64[D]')
+    communes, codes = np.unique(labels, return_inverse=True)
+    days = dates.astype('int64')
+    first = int(days.min()) if len(days) else 0
+    span = int(days.max()) - first + 1 if len(days) else 0
+
+    order = np.lexsort((days, codes))
+    events = commune_dates.to_numpy().astype('int64')[order]
+    return {
+        'communes': communes,
+        'dates': dates[order],
+        'events': events,
+        'keys': codes[order].astype('int64') * (span + 2) + (days[order] - first + 1),
+        'running': np.concatenate([[0], np.cumsum(events)]),
+        'first': first,
+        'span': span,
+    }
+
+
+def window_entries(index, start, end):
+    """
+    This function returns the first and last + 1 entries of every commune
+    within a window of start dates, both included
+    """
+    def day_key(date):
+        day = np.datetime64(pd.Timestamp(date).date(), 'D').astype('int64') - index['first'] + 1
+        return np.arange(len(index['communes']), dtype='int64') * (index['span'] + 2) + np.clip(day, 0, index['span'] + 1)
+
+    return (np.searchsorted(index['keys'], day_key(start), side='left'),
+            np.searchsorted(index['keys'], day_key(end), side='right'))
+
+
+def top_communes(index, start=TOP_START, end=TOP_END, top_n=TOP_N):
+    """
+    This function finds the top_n communes by number of events in a window
+    of start dates, from the differences of the running total of the
+    events, without going through the events of the other communes.
+
+    It returns a dict with:
+        - top: the top communes, by decreasing number of events
+        - cumulative: running total of events of the top communes over
+          the dates of the window
+    """
+    lo, hi = window_entries(index, start, end)
+    counts = index['running'][hi] - index['running'][lo]
+    top = np.argsort(-counts, kind='stable')[:top_n]
+    top = top[counts[top] > 0]
+
+    # Events of the top communes per date, in commune order
+    series = {index['communes'][c]: pd.Series(index['events'][lo[c]:hi[c]], index=index['dates'][lo[c]:hi[c]].astype('datetime64[ns]'))
+              for c in np.sort(top)}
+    pivot_data = pd.DataFrame(series).sort_index() if series else pd.DataFrame()
+    pivot_data.index.name = 'dat_deb'
+    pivot_data.columns.name = 'lib_commune'
+
+    # Running total, interpolated to create continuous lines
+    cumulative = pivot_data.astype(float).cumsum().interpolate(method='linear').fillna(0)
+    return {'top': index['communes'][top].tolist(), 'cumulative': cumulative}
+
+
+def event_aggregates(totals):
+    """
+    This function derives every aggregate of an event table used by the tabs
+    from its totals.
+
+    It returns a dict with:
+        - communes: event_count and average_duration, indexed by the
+          commune code in the commune dtype
+        - monthly: number of events per month of the start date
+        - commune_dates: the index of the events per commune and date, see
+          commune_date_index(), from which top_communes() charts any window
+    """
+    event_count = totals['event_count'].astype(int)
+    communes = pd.DataFrame({
+        'event_count': event_count,
+        'average_duration': totals['duration_sum'].reindex(event_count.index, fill_value=0)
+                            / totals['duration_count'].reindex(event_count.index, fill_value=0),
+    })
+
+    monthly = totals['monthly'].astype(int).reset_index(name='events')
+
+    return {'communes': communes, 'monthly': monthly, 'commune_dates': commune_date_index(totals['commune_dates'].astype(int))}
+
+
+def event_frame(communes, aggregates):
+    """
+    This function joins the event counts and average durations of event
+    aggregates with the communes, replacing NaN values with 0
+    """
+    totals = aggregates['communes'].rename_axis('Code INSEE').reset_index()
+    values = np.nan_to_num(align(totals, communes['Code INSEE'], ['event_count', 'average_duration']))
+    return communes.assign(event_count=values[:, 0].astype(int), average_duration=values[:, 1].round(2))
+
+
+def catnat_totals(catnat, after=CATNAT_AFTER):
+    """
+    This function counts the CatNat events per start date and peril
+    """
+    catnat = catnat[catnat['dat_deb'].dt.year > after]
+    return {'counts': catnat.groupby(['dat_deb', 'lib_risque_jo'], observed=True).size()}
+
+
+def catnat_aggregates(totals, perils=CATNAT_PERILS):
+    """
+    This function returns the CatNat event counts per start date and peril
+    from their totals
+    """
+    counts = totals['counts'].astype(int).unstack(fill_value=0)
+    counts.columns = counts.columns.astype(str)
+    return counts.reindex(columns=perils, fill_value=0)
+
+
+#==============================================================================
+# Event store
+#==============================================================================
+def read_lines(path, offset=0, complete=False):
+    """
+    This function reads a file from a byte offset to its end, and returns the
+    data with the offset following it. With complete, an unterminated last
+    line is left for a later read, as it may still be being appended.
+    """
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        data = file.read()
+    end = data.rfind(b'\n') + 1 if complete else len(data)
+    return data[:end], offset + end
+
+
+def parse_events(data, commune_dtype, header=None):
+    """
+    This function parses event CSV lines into the event schema, their first
+    line being the header when none is given
+    """
+    events = pd.read_csv(io.BytesIO(data), header=None if header else 'infer', names=header,
+                         usecols=EVENT_COLUMNS, dtype=EVENT_DTYPES, parse_dates=EVENT_DATES)
+    return typed_events(events, commune_dtype)
+
+
+def sort_events(events):
+    """
+    This function sorts events by peril, in the order of their categories, and
+    by start date. It returns them with the (start, stop) rows of each peril.
+    """
+    perils = events['lib_risque_jo'].cat.categories
+    codes = events['lib_risque_jo'].cat.codes.to_numpy()
+    order = np.lexsort((events['dat_deb'].to_numpy(), codes))
+    events = events.take(order).reset_index(drop=True)
+    offsets = np.searchsorted(codes[order], np.arange(len(perils) + 1))
+    return events, {peril: (int(offsets[k]), int(offsets[k + 1])) for k, peril in enumerate(perils)}
+
+
+def peril_slice(events, offsets, perils):
+    """
+    This function returns the events of consecutive perils of a sorted table,
+    a slice sharing its buffers
+    """
+    rows = [offsets[peril] for peril in perils]
+    return events.iloc[min(start for start, _ in rows):max(stop for _, stop in rows)]
+
+
+def commune_timelines(events):
+    """
+    This function indexes events by commune id: the events of the communes
+    of the commune table are copied sorted by commune id and start date, so
+    that the timeline of a commune is a range of consecutive rows. It returns
+    a dict with:
+        - codes: the commune codes, the categories of the commune dtype
+        - offsets: the first row of each commune id, and the number of rows
+        - events: the sorted events
+    """
+    communes = events['cod_commune'].cat
+    ids = communes.codes.to_numpy()
+    order = np.lexsort((events['dat_deb'].to_numpy(), ids))
+    order = order[ids[order] >= 0]
+    return {'codes': communes.categories, 'offsets': np.searchsorted(ids[order], np.arange(len(communes.categories) + 1)),
+            'events': events.take(order).reset_index(drop=True)}
+
+
+def commune_events(snapshot, code):
+    """
+    This function returns the events of a commune from an event store
+    snapshot, sorted by start date, as a slice of its commune index
+    """
+    index = snapshot['communes']
+    k = index['codes'].get_indexer([str(code)])[0]
+    if k < 0:
+        return index['events'].iloc[:0]
+    return index['events'].iloc[index['offsets'][k]:index['offsets'][k + 1]]
+
+
+class EventStore:
+    """
+    Single event table of append-only CSVs, sorted by peril and start date,
+    with the totals and aggregates of its views. Each view is a slice of the
+    table holding consecutive perils. Rows appended to the files are ingested
+    on their own, and only the totals they change are updated; any other
+    change reloads the files. Commune codes are read in the commune dtype,
+    see commune_dtype().
+
+    Readers get snapshots, replaced as a whole on every change.
+    """
+
+    def __init__(self, paths, views, commune_dtype):
+        self.paths = list(paths)
+        self.views = views
+        self.commune_dtype = commune_dtype
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """
+        This method returns the snapshot of the current files, a dict with:
+            - fingerprint: the fingerprints of the files read
+            - events: the sorted event table
+            - perils: the (start, stop) rows of each peril
+            - communes: the events by commune, see commune_timelines()
+            - totals, aggregates: computed by the functions of each view
+            - files: the header, bytes read and digest of them of each file
+        """
+        fingerprint = tuple(file_fingerprint(path) for path in self.paths)
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot['fingerprint'] == fingerprint:
+            return snapshot
+
+        with self.lock:
+            snapshot = self.snapshot
+            if snapshot is not None and snapshot['fingerprint'] == fingerprint:
+                return snapshot
+            if snapshot is not None and all(old == new or self.is_appended(path, snapshot['files'][path])
+                                            for path, old, new in zip(self.paths, snapshot['fingerprint'], fingerprint)):
+                self.snapshot = self.ingest(snapshot, fingerprint)
+            else:
+                self.snapshot = self.load(fingerprint)
+            return self.snapshot
+
+    def is_appended(self, path, state):
+        """
+        This method tells whether a file grew and still starts with the
+        bytes read, by their digest: rows edited in place are not appended
+        """
+        offset = state['offset']
+        if not os.path.exists(path) or os.path.getsize(path) <= offset:
+            return False
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            while file.tell() < offset:
+                digest.update(file.read(min(DIGEST_CHUNK_BYTES, offset - file.tell())))
+        return digest.digest() == state['digest'].digest()
+
+    def read(self, path, state=None):
+        """
+        This method parses the rows of a file following the bytes already
+        read, if any. It returns the events, None without new rows, and what
+        was read of the file.
+        """
+        data, offset = read_lines(path, state['offset'] if state else 0, complete=state is not None)
+        if state is None:
+            header = list(pd.read_csv(io.BytesIO(data), nrows=0).columns)
+            events = parse_events(data, self.commune_dtype)
+            digest = hashlib.sha1()
+        else:
+            header = state['header']
+            events = parse_events(data, self.commune_dtype, header) if data else None
+            digest = state['digest'].copy()
+        digest.update(data)
+        return events, {'header': header, 'offset': offset, 'digest': digest}
+
+    def view_totals(self, events, offsets):
+        """
+        This method computes the totals of every view of a sorted event table
+        """
+        return {name: totals(peril_slice(events, offsets, perils)) for name, (perils, totals, _) in self.views.items()}
+
+    def make_snapshot(self, fingerprint, events, offsets, totals, files):
+        """
+        This method builds a snapshot
+        """
+        aggregates = {name: aggregates(totals[name]) for name, (_, _, aggregates) in self.views.items()}
+        return freeze({'fingerprint': fingerprint, 'events': events, 'perils': offsets, 'communes': commune_timelines(events),
+                       'totals': totals, 'aggregates': aggregates, 'files': files})
+
+    def load(self, fingerprint):
+        """
+        This method reads the whole files, concurrently
+        """
+        with ThreadPoolExecutor(max_workers=len(self.paths)) as pool:
+            reads = list(pool.map(self.read, self.paths))
+        files = {path: state for path, (_, state) in zip(self.paths, reads)}
+        events = pd.concat([events for events, _ in reads], ignore_index=True)
+        events, offsets = sort_events(latest_arretes(typed_events(events, self.commune_dtype)))
+        return self.make_snapshot(fingerprint, events, offsets, self.view_totals(events, offsets), files)
+
+    def ingest(self, snapshot, fingerprint):
+        """
+        This method merges the rows appended to the files since the snapshot.
+        The arrêté periods they update are taken out of the events and totals,
+        and put back with their latest rows.
+        """
+        frames, files = [], {}
+        for path in self.paths:
+            events, files[path] = self.read(path, snapshot['files'][path])
+            if events is not None:
+                frames.append(events)
+        if not frames:
+            return dict(snapshot, fingerprint=fingerprint, files=files)
+        old = snapshot['events']
+        new = typed_events(pd.concat(frames, ignore_index=True), self.commune_dtype)
+
+        touched = pd.MultiIndex.from_frame(old[EVENT_KEY]).isin(pd.MultiIndex.from_frame(new[EVENT_KEY]))
+        replaced = old[touched]
+        merged = latest_arretes(typed_events(pd.concat([replaced, new], ignore_index=True), self.commune_dtype))
+
+        events, offsets = sort_events(typed_events(pd.concat([old[~touched], merged], ignore_index=True), self.commune_dtype))
+        removed = self.view_totals(*sort_events(replaced))
+        added = self.view_totals(*sort_events(merged))
+        totals = {name: combine_totals(combine_totals(total, removed[name], -1), added[name]) for name, total in snapshot['totals'].items()}
+        return self.make_snapshot(fingerprint, events, offsets, totals, files)
+
+
+def event_store(communes, paths=EVENT_CSVS.values()):
+    """
+    This function creates the event store of the dashboard, with the views of
+    the event maps and charts, reading commune codes in the dtype of the
+    codes of the communes
+    """
+    return EventStore(paths, {
+        'inon': (EVENT_VIEWS['inon'], event_totals, event_aggregates),
+        'sech': (EVENT_VIEWS['sech'], event_totals, event_aggregates),
+        'cat': (EVENT_VIEWS['cat'], catnat_totals, catnat_aggregates),
+    }, communes['Code INSEE'].dtype)
+
+
+#==============================================================================
+# Command line
+#==============================================================================
+def main():
+    """
+    This function checks the sources, converts the CSV sources into their
+    binary artifacts and loads every valid source concurrently, reporting
+    the time taken by each one. It runs in its own process: it builds the
+    artifacts the dashboard reads, but warms none of its caches, which its
+    first run fills. It returns 1 when a source is invalid or fails to load.
+    """
+    parser = argparse.ArgumentParser(description='Check the sources and build the binary data artifacts of the dashboard.')
+    parser.add_argument('--insee-csv', default=INSEE_CSV)
+    parser.add_argument('--insee-parquet', default=INSEE_PARQUET)
+    parser.add_argument('--lod-parquet', default=LOD_PARQUET)
+    parser.add_argument('--workers', type=int, default=None, help='number of threads, one per loader if omitted')
+    args = parser.parse_args()
+
+    problems = check_sources()
+    for name, problem in problems.items():
+        print(f'{SOURCES[name]}: {problem}')
+
+    if os.path.exists(args.insee_csv):
+        gdf = build_communes(args.insee_csv, args.insee_parquet)
+        print(f'{args.insee_parquet}: {len(gdf)} communes')
+
+        pyramid = build_pyramid(gdf, args.lod_parquet)
+        print(f'{args.lod_parquet}: {pyramid["level"].nunique()} levels')
+
+    # Loaders of the dashboard, the event store reading both event CSVs with
+    # the codes of the communes
+    communes = functools.partial(load_communes, args.insee_csv, args.insee_parquet)
+    loaders = {
+        'insee': (['insee'], communes),
+        **{peril: ([peril], functools.partial(load_predictions, path)) for peril, path in PREDICTION_CSVS.items()},
+        'historical': (['historical'], load_historical),
+        'events': (['insee', *(f'{name}_events' for name in EVENT_CSVS)], lambda: event_store(communes()).refresh()),
+        'soil': (['soil'], load_soil_map),
+    }
+    start = time.perf_counter()
+    _, reports = load_concurrently({name: loader for name, (names, loader) in loaders.items() if not set(names) & set(problems)}, args.workers)
+    for name, report in sorted(reports.items(), key=lambda item: -item[1]['seconds']):
+        error = '' if report['error'] is None else f"  {report['error']!r}"
+        print(f"{name:<12} {report['seconds']:.2f} s{error}")
+    print(f'Loaded in {time.perf_counter() - start:.2f} s')
+    return 1 if problems or any(report['error'] is not None for report in reports.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Map helpers
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import numpy as np
+import shapely
+import folium
+import branca.colormap as cm
+
+import risk_data
+
+
+# Map defaults shared by every map of the dashboard
+MAP_CENTER = [50.6292, 3.0573]
+MAP_ZOOM = 8
+
+# Deepest zoom of a jump to a commune
+MAX_ZOOM = 13
+
+# Commune attributes, which the rollups do not have, and the tooltip labels
+# of the rollup levels
+COMMUNE_FIELDS = ['Code INSEE', 'Commune']
+ROLLUP_ALIASES = {'Code Département': 'Département:', 'Code Canton': 'Canton:'}
+
+# Color ramps
+RISK_COLORS = ['#FFFFB2','#FFD700', '#FFC300','#FFB000', '#FF8C00', '#FF7000', '#FF4500', '#FF2400', '#FF0000', '#CC0000','#8B0000']
+FLOOD_COLORS = ['#ffffcc', '#41b6c4', '#0c2c84']
+
+# Risk map: tooltip fields, and the risk scale shown under it
+RISK_TOOLTIP = ['Code INSEE', 'Commune', 'risk_coul', 'risk_rem', 'risk_sech', 'normalized_historical_risk_score', 'average_risk']
+RISK_SCALE = "Niveau de risque: (Aucun risque) 0  -  1 (Risque maximum)"
+
+# Event maps: the (column, label) of each metric and the color ramp, by peril
+EVENT_METRICS = {
+    'inon': [('event_count', "Nombre d'Inondations"), ('average_duration', "Durée moyenne annuelle des inondations")],
+    'sech': [('event_count', "Nombre de sécheresses"), ('average_duration', "Durée moyenne annuelle de la sécheresse")],
+}
+EVENT_COLORS = {'inon': FLOOD_COLORS, 'sech': RISK_COLORS}
+
+# Number of colors sampled from a colormap, and coordinate precision (~1 m)
+PALETTE_SIZE = 256
+COORD_DECIMALS = 5
+
+
+#==============================================================================
+# Colors
+#==============================================================================
+def make_colormap(colors, values, caption=None):
+    """
+    This function creates a linear colormap spanning the values of a column
+    """
+    colormap = cm.LinearColormap(colors=colors, vmin=np.nanmin(values), vmax=np.nanmax(values))
+    if caption is not None:
+        colormap.caption = caption
+    return colormap
+
+
+def color_index(colormap, values, size=PALETTE_SIZE):
+    """
+    This function samples a colormap once into a palette of size colors and
+    returns it with the palette index of every value, computed in one
+    vectorized pass
+    """
+    samples = np.linspace(colormap.vmin, colormap.vmax, size)
+    palette = np.array([colormap.rgb_hex_str(x) for x in samples])
+
+    values = np.asarray(values, dtype=float)
+    span = colormap.vmax - colormap.vmin
+    if span <= 0:
+        return palette, np.zeros(len(values), dtype=int)
+    position = (np.nan_to_num(values, nan=colormap.vmin) - colormap.vmin) / span
+    index = np.clip(np.rint(position * (size - 1)), 0, size - 1).astype(int)
+    return palette, index
+
+
+def color_values(colormap, values):
+    """
+    This function returns the hex color of every value in one vectorized pass
+    """
+    palette, index = color_index(colormap, values)
+    return palette[index]
+
+
+#==============================================================================
+# Layers
+#==============================================================================
+def base_map(center=MAP_CENTER, zoom=MAP_ZOOM):
+    """
+    This function creates an empty Folium map, by default centered on
+    Nord-Pas-de-Calais
+    """
+    return folium.Map(location=center, zoom_start=zoom)
+
+
+def bounds_zoom(bounds, width, height, max_zoom=MAX_ZOOM):
+    """
+    This function returns the deepest zoom at which [[south, west], [north,
+    east]] bounds fit in a map of the given size in pixels
+    """
+    (south, west), (north, east) = bounds
+    latitude = np.radians((south + north) / 2)
+    spans = [(east - west) / 360 * 256 / width, (north - south) / np.cos(latitude) / 360 * 256 / height]
+    return int(min(max_zoom, np.floor(-np.log2(max(max(spans), 1e-9)))))
+
+
+def rollup_frame(gdf, rollup, by, fields):
+    """
+    This function averages the given fields of the communes over each rollup
+    of the geometry pyramid
+    """
+    means = gdf.groupby(by, observed=True)[fields].mean().round(4).reset_index()
+    return rollup.merge(means, on=by, how='inner')
+
+
+def feature_collection(gdf, fields):
+    """
+    This function keeps the non-empty geometries and the given property
+    columns, with coordinates rounded to keep the GeoJSON payload small
+    """
+    keep = gdf.geometry.notna() & ~gdf.geometry.is_empty
+    features = gdf.loc[keep, fields + [gdf.geometry.name]].copy()
+    features[gdf.geometry.name] = shapely.transform(features.geometry.values, lambda coords: np.round(coords, COORD_DECIMALS))
+    return features
+
+
+def choropleth_layer(gdf, value_column, colormap, fields, aliases, fill_opacity=0.8, name=None):
+    """
+    This function renders a whole GeoDataFrame as a single GeoJson layer.
+    Colors are computed for the whole frame at once and the tooltip reads the
+    feature properties.
+    """
+    features = feature_collection(gdf, fields)
+    features['fill_color'] = color_values(colormap, features[value_column].to_numpy())
+
+    return folium.GeoJson(
+        data=features,
+        style_function=lambda feature: {
+            'fillColor': feature['properties']['fill_color'], 'color': 'black', 'weight': 0.5, 'fillOpacity': fill_opacity
+        },
+        tooltip=folium.GeoJsonTooltip(fields=fields, aliases=aliases, style='font-size: 16px;'),
+        name=name,
+    )
+
+
+def choropleth_map(gdf, value_column, colormap, fields, aliases, pyramid, center=MAP_CENTER, zoom=MAP_ZOOM, fill_opacity=0.8):
+    """
+    This function creates a Folium map of a GeoDataFrame aligned with the
+    communes, in a single layer at the level of the geometry pyramid matching
+    the zoom. Communes with a missing value are not shown.
+    """
+    level = risk_data.lod_level(zoom)
+    by = risk_data.rollup_columns(level)
+
+    shown = gdf.set_geometry(pyramid[level].geometry.values) if by is None else gdf
+    shown = shown[shown[value_column].notna()]
+
+    # Average the values over the rollups of the coarse levels
+    if by is not None:
+        aliases = [ROLLUP_ALIASES[column] for column in by] + [alias for field, alias in zip(fields, aliases) if field not in COMMUNE_FIELDS]
+        fields = [field for field in fields if field not in COMMUNE_FIELDS]
+        shown = rollup_frame(shown, pyramid[level], by, fields)
+        fields = by + fields
+
+    m = base_map(center, zoom)
+    choropleth_layer(shown, value_column, colormap, fields, aliases, fill_opacity=fill_opacity).add_to(m)
+    colormap.add_to(m)
+    return m
+
+
+def tooltip_html(row, fields, aliases, footer=None):
+    """
+    This function formats the tooltip fields of a single row as HTML
+    """
+    lines = [f"<b>{alias}</b> {row[field]}" for field, alias in zip(fields, aliases)]
+    if footer is not None:
+        lines.append(footer)
+    lines = '<br>'.join(lines)
+    return f"<div style='font-size: 16px;'>{lines}</div>"
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Profiling
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import os
+import json
+import time
+import logging
+import contextlib
+import functools
+import threading
+import tracemalloc
+from logging.handlers import RotatingFileHandler
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+
+# One JSON line per rerun is appended to PROFILE_LOG, rotated past
+# PROFILE_LOG_BYTES; an empty PREVIRISQUE_PROFILE_LOG disables the log
+PROFILE_LOG = os.environ.get('PREVIRISQUE_PROFILE_LOG', 'profile.jsonl')
+PROFILE_LOG_BYTES = 10 * 1024 ** 2
+PROFILE_LOG_BACKUPS = 3
+
+# Allocated memory is traced only when PREVIRISQUE_PROFILE_MEMORY is set,
+# tracemalloc slowing every allocation down
+if os.environ.get('PREVIRISQUE_PROFILE_MEMORY') and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+#==============================================================================
+# Log
+#==============================================================================
+def profile_logger(path=PROFILE_LOG):
+    """
+    This function returns the logger of the rerun profiles, shared by every
+    session of the process, or None when the log is disabled
+    """
+    global _logger
+    if not path:
+        return None
+    with _logger_lock:
+        if _logger is None:
+            handler = RotatingFileHandler(path, maxBytes=PROFILE_LOG_BYTES, backupCount=PROFILE_LOG_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            _logger = logging.getLogger('previrisque.profile')
+            _logger.setLevel(logging.INFO)
+            _logger.propagate = False
+            _logger.addHandler(handler)
+    return _logger
+
+
+def row_count(result):
+    """
+    This function returns the number of rows of a loader result, None for
+    results without rows
+    """
+    if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(result)
+    return None
+
+
+#==============================================================================
+# Profiler
+#==============================================================================
+class Profiler:
+    """
+    Recorder of the stages of one rerun. Each stage records its wall time,
+    cache hit or miss, row count, allocated memory and the bytes of the
+    messages sent to the browser while it ran; stages nest. Each thread has
+    its own open stages.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+        self.start = time.perf_counter()
+        self.stages = []
+        self.local = threading.local()
+
+    @property
+    def stack(self):
+        """
+        This property returns the open stages of the calling thread
+        """
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    #--------------------------------------------------------------------------
+    # Stages
+    #--------------------------------------------------------------------------
+    def begin(self, name):
+        """
+        This method opens a stage and returns its record
+        """
+        stage = {'stage': name, 'depth': len(self.stack), 'seconds': None, 'cache': None, 'rows': None,
+                 'allocated_bytes': None, 'peak_bytes': None, 'payload_bytes': 0}
+        if tracemalloc.is_tracing():
+            if self.stack:
+                parent = self.stack[-1]
+                parent['_peak'] = max(parent['_peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            stage['_memory'] = stage['_peak'] = tracemalloc.get_traced_memory()[0]
+        stage['_start'] = time.perf_counter()
+        self.stages.append(stage)
+        self.stack.append(stage)
+        return stage
+
+    def end(self, stage):
+        """
+        This method closes a stage
+        """
+        stage['seconds'] = round(time.perf_counter() - stage.pop('_start'), 6)
+        if '_memory' in stage:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(stage.pop('_peak'), peak)
+            stage['allocated_bytes'] = current - stage['_memory']
+            stage['peak_bytes'] = peak - stage.pop('_memory')
+            tracemalloc.reset_peak()
+            if len(self.stack) > 1:
+                parent = self.stack[-2]
+                parent['_peak'] = max(parent['_peak'], peak)
+        self.stack.remove(stage)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        This method times a block as a stage, yielding its record
+        """
+        stage = self.begin(name)
+        try:
+            yield stage
+        finally:
+            self.end(stage)
+
+    def nested(self, stage, func):
+        """
+        This method wraps a function run by another thread, so that its stages
+        nest under a stage of the calling thread
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.local.stack = [stage]
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.local.stack = []
+        return wrapper
+
+    def profiled(self, func=None, name=None):
+        """
+        This method decorates a function so that each call is a stage, named
+        after the function by default
+        """
+        if func is None:
+            return functools.partial(self.profiled, name=name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name or func.__name__) as stage:
+                result = func(*args, **kwargs)
+                stage['rows'] = row_count(result)
+                return result
+        return wrapper
+
+    def cached(self, cache):
+        """
+        This method returns a decorator caching a loader with a Streamlit cache
+        decorator, its calls being stages that tell whether the cache was hit
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def compute(*args, **kwargs):
+                # Only runs on a cache miss
+                if self.stack:
+                    self.stack[-1]['cache'] = 'miss'
+                return func(*args, **kwargs)
+
+            cached_func = cache(compute)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(func.__name__) as stage:
+                    stage['cache'] = 'hit'
+                    result = cached_func(*args, **kwargs)
+                    stage['rows'] = row_count(result)
+                    return result
+            wrapper.clear = cached_func.clear
+            return wrapper
+        return decorator
+
+    #--------------------------------------------------------------------------
+    # Payload
+    #--------------------------------------------------------------------------
+    def watch_messages(self, ctx):
+        """
+        This method counts the bytes of the messages a script run sends to the
+        browser, adding them to every open stage
+        """
+        if ctx is None:
+            return
+        enqueue = getattr(ctx, '_profile_enqueue', None)
+        if enqueue is None:
+            enqueue = ctx._profile_enqueue = ctx._enqueue
+
+        def counted(msg):
+            size = msg.ByteSize()
+            for stage in self.stack:
+                stage['payload_bytes'] += size
+            enqueue(msg)
+        ctx._enqueue = counted
+
+    #--------------------------------------------------------------------------
+    # Report
+    #--------------------------------------------------------------------------
+    def finish(self, path=PROFILE_LOG):
+        """
+        This method closes the open stages and appends the profile of the rerun
+        to the log. It returns the profile.
+        """
+        for stage in reversed(list(self.stack)):
+            self.end(stage)
+        profile = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'session': self.session,
+            'seconds': round(time.perf_counter() - self.start, 6),
+            'stages': self.stages,
+        }
+        logger = profile_logger(path)
+        if logger is not None:
+            logger.info(json.dumps(profile))
+        return profile
+
+
+def profile_frame(profile):
+    """
+    This function returns the stages of a profile as a table, nested stage
+    names being prefixed by their depth
+    """
+    stages = pd.DataFrame(profile['stages'])
+    if stages.empty:
+        return stages
+    stages['stage'] = ['· ' * depth + name for depth, name in zip(stages.pop('depth'), stages['stage'])]
+    return stages
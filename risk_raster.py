@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Raster maps
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import io
+import os
+import base64
+
+import numpy as np
+import shapely
+import folium
+from PIL import Image
+
+import risk_data
+import risk_maps as rm
+
+
+# Commune-ID grid of the communes: each pixel holds the row position of the
+# commune covering its center, -1 outside every commune. Rows are evenly
+# spaced in Web Mercator, so that the image lines up with the base map.
+RASTER_NPZ = 'insee_raster.npz'
+RASTER_WIDTH = 2048
+
+# Images are 8-bit palette PNGs: TRANSPARENT colors sampled from the colormap
+# and a transparent one, at a zlib level traded for encoding speed
+TRANSPARENT = 255
+PNG_LEVEL = 1
+
+
+#==============================================================================
+# Grid
+#==============================================================================
+def mercator_y(lat):
+    """
+    This function projects latitudes to Web Mercator, in radians
+    """
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def mercator_lat(y):
+    """
+    This function converts Web Mercator ordinates, in radians, to latitudes
+    """
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+
+def build_raster(communes, npz_path=RASTER_NPZ, width=RASTER_WIDTH):
+    """
+    This function rasterizes the communes into a commune-ID grid covering
+    them, width pixels wide, and saves it. Each commune only tests the pixels
+    of its bounding box.
+
+    It returns a dict with:
+        - grid: the commune row position of every pixel, -1 outside
+        - bounds: the [[south, west], [north, east]] bounds of the grid
+        - codes: the commune codes the positions refer to
+    """
+    geometry = communes.geometry.values
+    shapely.prepare(geometry)
+    west, south, east, north = shapely.total_bounds(geometry)
+    top, bottom = mercator_y(north), mercator_y(south)
+    height = int(np.ceil(width * (top - bottom) / np.radians(east - west)))
+
+    # Pixel centers, west to east and north to south
+    lons = west + (np.arange(width) + 0.5) * (east - west) / width
+    lats = mercator_lat(top - (np.arange(height) + 0.5) * (top - bottom) / height)
+
+    grid = np.full((height, width), -1, dtype='int32')
+    for i, (geom, (min_x, min_y, max_x, max_y)) in enumerate(zip(geometry, shapely.bounds(geometry))):
+        if geom is None or geom.is_empty:
+            continue
+        c0, c1 = np.searchsorted(lons, min_x, side='left'), np.searchsorted(lons, max_x, side='right')
+        r0, r1 = np.searchsorted(-lats, -max_y, side='left'), np.searchsorted(-lats, -min_y, side='right')
+        if c0 >= c1 or r0 >= r1:
+            continue
+        x, y = np.meshgrid(lons[c0:c1], lats[r0:r1])
+        window = grid[r0:r1, c0:c1]
+        window[shapely.contains_xy(geom, x, y)] = i
+
+    raster = {'grid': grid, 'bounds': np.array([[south, west], [north, east]]), 'codes': np.asarray(communes['Code INSEE'], dtype=str)}
+    tmp_path = f'{npz_path}.tmp.npz'
+    np.savez_compressed(tmp_path, **raster)
+    os.replace(tmp_path, npz_path)
+    return raster
+
+
+def load_raster(communes, csv_path=risk_data.INSEE_CSV, npz_path=RASTER_NPZ, width=RASTER_WIDTH):
+    """
+    This function loads the commune-ID grid, rebuilding it when it is
+    missing, older than the commune CSV, of another width or built for
+    other communes
+    """
+    if not risk_data.is_stale(npz_path, csv_path):
+        with np.load(npz_path) as data:
+            raster = {name: data[name] for name in data.files}
+        if raster['grid'].shape[1] == width and np.array_equal(raster['codes'], np.asarray(communes['Code INSEE'], dtype=str)):
+            return raster
+    return build_raster(communes, npz_path, width)
+
+
+def raster_lookup(raster, lon, lat):
+    """
+    This function returns the row position of the commune under a point
+    from the grid, None outside every commune
+    """
+    grid = raster['grid']
+    (south, west), (north, east) = raster['bounds']
+    height, width = grid.shape
+    col = int(np.floor((lon - west) / (east - west) * width))
+    row = int(np.floor((mercator_y(north) - mercator_y(lat)) / (mercator_y(north) - mercator_y(south)) * height))
+    if not (0 <= row < height and 0 <= col < width) or grid[row, col] < 0:
+        return None
+    return int(grid[row, col])
+
+
+#==============================================================================
+# Image
+#==============================================================================
+def color_raster(raster, colormap, values, fill_opacity=0.8):
+    """
+    This function colors the grid with the values of the communes, aligned
+    with its positions, as a palette image built in a single take. Communes
+    with a missing value and pixels outside every commune are transparent.
+
+    It returns the image as a PNG data URL.
+    """
+    palette, index = rm.color_index(colormap, values, size=TRANSPARENT)
+    rgb = [int(color[k:k + 2], 16) for color in palette for k in (1, 3, 5)]
+
+    # Palette index of every commune, and the transparent one last for the
+    # pixels outside every commune
+    index = np.where(np.isnan(np.asarray(values, dtype=float)), TRANSPARENT, index).astype('uint8')
+    image = Image.fromarray(np.append(index, np.uint8(TRANSPARENT)).take(raster['grid']), 'P')
+    image.putpalette(rgb + [0, 0, 0])
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=PNG_LEVEL, transparency=bytes([round(fill_opacity * 255)] * TRANSPARENT + [0]))
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def raster_layer(raster, colormap, values, fill_opacity=0.8):
+    """
+    This function renders the values of the communes as a single image
+    layer, letting clicks through to the map
+    """
+    return folium.raster_layers.ImageOverlay(image=color_raster(raster, colormap, values, fill_opacity),
+                                             bounds=raster['bounds'].tolist(), interactive=False)
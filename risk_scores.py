@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Batch scores
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import os
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import risk_data
+
+
+# Columns of the score table: the commune, the year, the risk of each peril
+# of the risk cube and the combined score, their average
+SCORE_KEYS = ['Code INSEE', 'Commune', 'year']
+SCORE_COMPONENTS = ['risk_coul', 'risk_rem', 'risk_sech', 'normalized_historical_risk_score']
+SCORE_COLUMN = 'average_risk'
+
+# Rows written at once to the output file
+SCORE_CHUNK_ROWS = 100000
+
+SCORES_PARQUET = 'risk_scores.parquet'
+
+
+#==============================================================================
+# Scores
+#==============================================================================
+def score_table(communes, cube, years=None):
+    """
+    This function computes the score table of every commune and year of the
+    risk cube, or of the given years, in one vectorized pass over the cube.
+    As on the dashboard, communes without every risk get no combined score.
+
+    The rows are ordered by commune, then year.
+    """
+    year_indices = np.arange(len(cube['years'])) if years is None else np.array([cube['years'].index(str(year)) for year in years], dtype=int)
+    n_communes, n_years = len(communes), len(year_indices)
+
+    # (communes, perils, years) -> (communes x years, perils)
+    values = cube['values'][:, :, year_indices].transpose(0, 2, 1).reshape(n_communes * n_years, len(SCORE_COMPONENTS))
+    average = np.where(cube['complete'][:, None], cube['average'][:, year_indices], np.nan).reshape(-1)
+
+    scores = pd.DataFrame({
+        'Code INSEE': pd.Categorical.from_codes(np.repeat(communes['Code INSEE'].cat.codes.to_numpy(), n_years), dtype=communes['Code INSEE'].dtype),
+        'Commune': pd.Categorical.from_codes(np.repeat(communes['Commune'].cat.codes.to_numpy(), n_years), dtype=communes['Commune'].dtype),
+        'year': np.tile(np.array(cube['years'], dtype='int16')[year_indices], n_communes),
+    })
+    for i, column in enumerate(SCORE_COMPONENTS):
+        scores[column] = values[:, i]
+    scores[SCORE_COLUMN] = average
+    return scores
+
+
+def load_cube():
+    """
+    This function reads the sources with the loaders of the dashboard and
+    returns the communes and their risk cube
+    """
+    communes = risk_data.load_communes()
+    return communes, risk_data.load_risk_cube(communes)
+
+
+#==============================================================================
+# Export
+#==============================================================================
+def write_scores(scores, path, chunk_rows=SCORE_CHUNK_ROWS):
+    """
+    This function streams the score table to a Parquet or CSV file, by the
+    extension of the path, chunk_rows rows at a time. The file is written
+    atomically.
+    """
+    tmp_path = f'{path}.tmp'
+    if path.endswith('.parquet'):
+        schema = pa.Schema.from_pandas(scores.iloc[:0], preserve_index=False)
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for start in range(0, len(scores), chunk_rows):
+                writer.write_table(pa.Table.from_pandas(scores.iloc[start:start + chunk_rows], schema=schema, preserve_index=False))
+    elif path.endswith('.csv'):
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as file:
+            for start in range(0, max(len(scores), 1), chunk_rows):
+                scores.iloc[start:start + chunk_rows].to_csv(file, index=False, header=start == 0)
+    else:
+        raise ValueError(f'unsupported score file {path}, expected .parquet or .csv')
+    os.replace(tmp_path, path)
+
+
+#==============================================================================
+# Command line
+#==============================================================================
+def main():
+    """
+    This function exports the score table of every commune and year
+    """
+    parser = argparse.ArgumentParser(description='Export the risk scores of every commune and year.')
+    parser.add_argument('--output', default=SCORES_PARQUET, help='.parquet or .csv file')
+    parser.add_argument('--years', nargs='+', default=None, help='years to export, every prediction year if omitted')
+    parser.add_argument('--complete', action='store_true', help='only export the communes with a combined score')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    communes, cube = load_cube()
+    unknown = [year for year in args.years or [] if year not in cube['years']]
+    if unknown:
+        parser.error(f"unknown years {', '.join(unknown)}, the prediction years are {', '.join(cube['years'])}")
+    scores = score_table(communes, cube, args.years)
+    if args.complete:
+        scores = scores[scores[SCORE_COLUMN].notna()]
+    write_scores(scores, args.output)
+    print(f'{args.output}: {len(scores)} rows in {time.perf_counter() - start:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
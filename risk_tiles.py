@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Vector tiles
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import os
+import math
+import shutil
+import hashlib
+
+import numpy as np
+import pandas as pd
+import shapely
+import mapbox_vector_tile
+
+import risk_data
+
+
+# Tiles are written to TILES_DIR/<tileset>/{z}/{x}/{y}.pbf, the tileset being
+# a hash of the geometry and attributes so that browsers can cache tiles.
+# The dashboard writes them to the choropleth component, which serves them
+# from its own origin. Only the TILESET_KEEP most recently used tilesets are
+# kept: the current one and the one sessions may still show.
+TILES_DIR = 'tiles'
+TILESET_KEEP = 2
+TILE_ZOOMS = range(6, 13)
+TILE_LAYER = 'communes'
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+# Web Mercator
+EARTH_RADIUS = 6378137.0
+ORIGIN = math.pi * EARTH_RADIUS
+
+
+#==============================================================================
+# Tiling
+#==============================================================================
+def to_mercator(geometry):
+    """
+    This function projects longitude/latitude geometries to Web Mercator
+    """
+    def project(coords):
+        x = np.radians(coords[:, 0]) * EARTH_RADIUS
+        y = np.log(np.tan(np.pi / 4 + np.radians(coords[:, 1]) / 2)) * EARTH_RADIUS
+        return np.column_stack([x, y])
+    return shapely.transform(geometry, project)
+
+
+def tile_index(lon, lat, zoom):
+    """
+    This function returns the x, y index of the tile containing a point
+    """
+    n = 2 ** zoom
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(x, y, zoom):
+    """
+    This function returns the Web Mercator bounds of a tile
+    """
+    size = 2 * ORIGIN / 2 ** zoom
+    return (-ORIGIN + x * size, ORIGIN - (y + 1) * size, -ORIGIN + (x + 1) * size, ORIGIN - y * size)
+
+
+def tile_level(zoom):
+    """
+    This function returns the commune level of the geometry pyramid used for
+    the tiles of a zoom; the rollups have no commune attributes
+    """
+    level = risk_data.lod_level(zoom)
+    if risk_data.rollup_columns(level) is not None:
+        return next(name for _, name, by, _ in risk_data.LOD_LEVELS if by is None)
+    return level
+
+
+#==============================================================================
+# Attributes
+#==============================================================================
+def tile_attributes(static, frames):
+    """
+    This function gathers the feature properties of the tiles: the static
+    columns, and every column of each frame suffixed with its variant (a year
+    or a peril), all aligned with the communes
+    """
+    columns = [static.reset_index(drop=True)]
+    for variant, frame in frames.items():
+        columns.append(frame.reset_index(drop=True).add_suffix(f'_{variant}'))
+    return pd.concat(columns, axis=1)
+
+
+def tile_records(attributes):
+    """
+    This function converts the attributes to one property dict per commune,
+    without the missing values
+    """
+    records = attributes.astype(object).where(attributes.notna(), None).to_dict('records')
+    return [{key: value for key, value in record.items() if value is not None} | {'i': i} for i, record in enumerate(records)]
+
+
+def tileset_name(attributes, pyramid, zooms):
+    """
+    This function hashes the inputs of a tileset
+    """
+    digest = hashlib.sha1(pd.util.hash_pandas_object(attributes, index=False).to_numpy().tobytes())
+    for zoom in zooms:
+        digest.update(b''.join(shapely.to_wkb(pyramid[tile_level(zoom)].geometry.values)))
+    return digest.hexdigest()[:16]
+
+
+#==============================================================================
+# Build
+#==============================================================================
+def build_tiles(attributes, pyramid, directory=TILES_DIR, zooms=TILE_ZOOMS):
+    """
+    This function pre-generates the Mapbox Vector Tiles of the communes, with
+    their attributes as feature properties, for every zoom covering them.
+    A tileset that already exists is not rebuilt. Older tilesets are pruned.
+
+    It returns the tileset name, the sub-directory holding the tiles.
+    """
+    tileset = tileset_name(attributes, pyramid, zooms)
+    path = os.path.join(directory, tileset)
+    if os.path.isdir(path):
+        os.utime(path)
+        risk_data.prune_directories(directory, TILESET_KEEP)
+        return tileset
+
+    records = tile_records(attributes)
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+
+    for zoom in zooms:
+        geometry = pyramid[tile_level(zoom)].geometry.values
+        mercator = to_mercator(geometry)
+        tree = shapely.STRtree(mercator)
+
+        min_lon, min_lat, max_lon, max_lat = shapely.total_bounds(geometry)
+        x0, y0 = tile_index(min_lon, max_lat, zoom)
+        x1, y1 = tile_index(max_lon, min_lat, zoom)
+
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                bounds = tile_bounds(x, y, zoom)
+                hits = tree.query(shapely.box(*bounds))
+                if not len(hits):
+                    continue
+
+                # Clip with a buffer so that borders are not drawn at tile edges
+                margin = (bounds[2] - bounds[0]) * TILE_BUFFER / TILE_EXTENT
+                clipped = shapely.clip_by_rect(mercator[hits], bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin)
+                features = [
+                    {'geometry': geom, 'properties': records[i], 'id': int(i)}
+                    for geom, i in zip(clipped, hits) if not geom.is_empty
+                ]
+                if not features:
+                    continue
+
+                tile = mapbox_vector_tile.encode(
+                    [{'name': TILE_LAYER, 'features': features}],
+                    default_options={'quantize_bounds': bounds, 'extents': TILE_EXTENT},
+                )
+                os.makedirs(os.path.join(tmp_path, str(zoom), str(x)), exist_ok=True)
+                with open(os.path.join(tmp_path, str(zoom), str(x), f'{y}.pbf'), 'wb') as file:
+                    file.write(tile)
+
+    os.replace(tmp_path, path)
+    risk_data.prune_directories(directory, TILESET_KEEP)
+    return tileset
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Commune code tests
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import numpy as np
+import pandas as pd
+import pytest
+
+import risk_data
+
+
+# Communes whose codes start with a zero or are Corsican, out of code order
+COMMUNES = [
+    ('59350', 'LILLE', '59', '8', 'POLYGON ((3.0 50.6, 3.1 50.6, 3.1 50.7, 3.0 50.6))'),
+    ('01001', "L'ABERGEMENT-CLEMENCIAT", '01', '10', 'POLYGON ((4.9 46.1, 5.0 46.1, 5.0 46.2, 4.9 46.1))'),
+    ('2A004', 'AJACCIO', '2A', '99', 'POLYGON ((8.7 41.9, 8.8 41.9, 8.8 42.0, 8.7 41.9))'),
+]
+
+# Flood events of two communes and of a commune out of the commune table
+EVENTS = [
+    ('INTE0000001A', '2A004', 'Ajaccio', 'Inondations et/ou coulées de boue', '2000-01-01', '2000-01-02', '2000-02-01'),
+    ('INTE0000001A', '01001', "L'Abergement-Clémenciat", 'Inondations et/ou coulées de boue', '2000-01-01', '2000-01-03', '2000-02-01'),
+    ('INTE0000001A', '99999', 'Ailleurs', 'Inondations et/ou coulées de boue', '2000-01-01', '2000-01-02', '2000-02-01'),
+]
+
+
+#==============================================================================
+# Helpers
+#==============================================================================
+@pytest.fixture
+def communes(tmp_path):
+    """
+    This fixture writes a commune CSV and loads it through its artifact
+    """
+    csv_path = tmp_path / risk_data.INSEE_CSV
+    pd.DataFrame(COMMUNES, columns=risk_data.INSEE_COLUMNS).to_csv(csv_path, index=False)
+    risk_data.build_communes(str(csv_path), str(tmp_path / risk_data.INSEE_PARQUET))
+    return risk_data.load_communes(str(csv_path), str(tmp_path / risk_data.INSEE_PARQUET))
+
+
+def write_predictions(path, peril, rows):
+    """
+    This function writes a prediction CSV of one year
+    """
+    pd.DataFrame(rows, columns=['Code INSEE', f'{risk_data.PREDICTION_PREFIXES[peril]}2024']).to_csv(path, index=False)
+    return risk_data.load_predictions(path)
+
+
+#==============================================================================
+# Tests
+#==============================================================================
+def test_codes_keep_their_text(communes):
+    assert list(communes['Code INSEE']) == ['59350', '01001', '2A004']
+    assert list(communes['Code INSEE'].cat.codes) == [0, 1, 2]
+    assert list(communes['Code Département']) == ['59', '01', '2A']
+
+
+def test_search_finds_codes(communes):
+    index = risk_data.build_commune_index(communes)
+    assert risk_data.search_communes(index, '01001') == [1]
+    assert risk_data.search_communes(index, '2a') == [2]
+
+
+def test_risk_cube_joins_on_commune_ids(communes, tmp_path):
+    predictions = [write_predictions(tmp_path / f'{peril}.csv', peril, [('59350', 0.3), ('2A004', 0.2), ('01001', 0.1)])
+                   for peril in ['coul', 'rem', 'sech']]
+    historical = pd.DataFrame({'Code INSEE': ['01001', '99999'], 'normalized_historical_risk_score': [0.5, 0.9]})
+    cube = risk_data.build_risk_cube(communes['Code INSEE'], *predictions, historical)
+
+    np.testing.assert_array_equal(cube['values'][:, 0, 0], [0.3, 0.1, 0.2])
+    np.testing.assert_array_equal(cube['values'][:, 3, 0], [np.nan, 0.5, np.nan])
+    assert list(cube['complete']) == [False, True, False]
+
+
+def test_events_join_on_commune_ids(communes, tmp_path):
+    path = tmp_path / 'events.csv'
+    pd.DataFrame(EVENTS, columns=risk_data.EVENT_COLUMNS).to_csv(path, index=False)
+    snapshot = risk_data.event_store(communes, [str(path)]).refresh()
+
+    assert snapshot['events']['cod_commune'].dtype == communes['Code INSEE'].dtype
+    assert len(snapshot['events']) == 3
+    assert list(risk_data.event_frame(communes, snapshot['aggregates']['inon'])['event_count']) == [0, 1, 1]
+    assert list(risk_data.commune_events(snapshot, '2A004')['lib_commune']) == ['Ajaccio']
+    assert risk_data.commune_events(snapshot, '99999').empty
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Credit Agricole Risk Dashboard - Event store tests
+###############################################################################
+
+#==============================================================================
+# Initiating
+#==============================================================================
+
+# Libraries
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import risk_data
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Updated row of the first of the two periods of an arrêté of a commune
+UPDATED_PERIOD = 'INTE0000364A,59237,Flêtre,54.0,Inondations et/ou coulées de boue,2000-05-06,2000-05-07,2000-07-21,2000-08-01,2023-01-01'
+
+# Row of an arrêté that is not in the files
+NEW_ARRETE = 'INTE2300001A,59237,Flêtre,54.0,Inondations et/ou coulées de boue,2023-01-10,2023-01-12,2023-03-01,2023-03-02,2023-03-02'
+
+
+#==============================================================================
+# Helpers
+#==============================================================================
+@pytest.fixture(scope='module')
+def communes():
+    """
+    This fixture reads the codes of the bundled communes, in the commune dtype
+    """
+    codes = pd.read_csv(os.path.join(ROOT, risk_data.INSEE_CSV), usecols=['Code INSEE'], dtype=str)['Code INSEE']
+    return pd.DataFrame({'Code INSEE': codes.astype(risk_data.commune_dtype(codes))})
+
+
+@pytest.fixture
+def event_csvs(tmp_path):
+    """
+    This fixture copies the event CSVs to a temporary directory, and returns
+    their paths
+    """
+    paths = []
+    for filename in risk_data.EVENT_CSVS.values():
+        shutil.copy(os.path.join(ROOT, filename), tmp_path / filename)
+        paths.append(str(tmp_path / filename))
+    return paths
+
+
+def append_rows(path, *rows):
+    """
+    This function appends rows to a CSV
+    """
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(''.join(f'{row}\n' for row in rows))
+
+
+def sorted_events(events):
+    """
+    This function returns the events in a canonical order
+    """
+    events = events.astype({column: str for column in risk_data.EVENT_DTYPES})
+    return events.sort_values(list(events.columns)).reset_index(drop=True)
+
+
+def assert_same_snapshot(snapshot, expected):
+    """
+    This function checks that two snapshots hold the same events, and the
+    same aggregates for every view
+    """
+    pd.testing.assert_frame_equal(sorted_events(snapshot['events']), sorted_events(expected['events']))
+    for name in ['inon', 'sech']:
+        aggregates, expected_aggregates = snapshot['aggregates'][name], expected['aggregates'][name]
+        pd.testing.assert_frame_equal(aggregates['communes'], expected_aggregates['communes'], check_dtype=False)
+        pd.testing.assert_frame_equal(aggregates['monthly'], expected_aggregates['monthly'], check_dtype=False)
+        for key, value in expected_aggregates['commune_dates'].items():
+            np.testing.assert_array_equal(aggregates['commune_dates'][key], value)
+    pd.testing.assert_frame_equal(snapshot['aggregates']['cat'], expected['aggregates']['cat'], check_dtype=False)
+
+
+#==============================================================================
+# Tests
+#==============================================================================
+def test_ingest_matches_reload(communes, event_csvs):
+    store = risk_data.event_store(communes, event_csvs)
+    store.refresh()
+    append_rows(event_csvs[0], UPDATED_PERIOD, NEW_ARRETE)
+
+    assert_same_snapshot(store.refresh(), risk_data.event_store(communes, event_csvs).refresh())
+
+
+def test_refresh_reloads_rows_edited_in_place(communes, event_csvs):
+    store = risk_data.event_store(communes, event_csvs)
+    store.refresh()
+    with open(event_csvs[0], 'rb') as file:
+        data = file.read()
+    with open(event_csvs[0], 'wb') as file:
+        file.write(data.replace(b'1995-07-10,1995-07-12', b'1995-07-10,1995-07-19', 1))
+
+    snapshot = store.refresh()
+    assert_same_snapshot(snapshot, risk_data.event_store(communes, event_csvs).refresh())
+    events = risk_data.commune_events(snapshot, '59001')
+    assert list(events.loc[events['dat_deb'] == pd.Timestamp('1995-07-10'), 'dat_fin']) == [pd.Timestamp('1995-07-19')]
+
+
+def test_load_reads_unterminated_last_line(communes, event_csvs):
+    expected = risk_data.event_store(communes, event_csvs).refresh()
+    with open(event_csvs[1], 'rb') as file:
+        data = file.read()
+    with open(event_csvs[1], 'wb') as file:
+        file.write(data.rstrip(b'\r\n'))
+
+    assert_same_snapshot(risk_data.event_store(communes, event_csvs).refresh(), expected)
+
+
+def test_ingest_keeps_other_periods(communes, event_csvs):
+    store = risk_data.event_store(communes, event_csvs)
+    store.refresh()
+    append_rows(event_csvs[0], UPDATED_PERIOD)
+
+    events = risk_data.commune_events(store.refresh(), '59237')
+    periods = events[events['cod_nat_catnat'] == 'INTE0000364A'].groupby('dat_deb')['dat_fin'].unique()
+    assert list(periods.index) == [pd.Timestamp('2000-05-06'), pd.Timestamp('2000-05-09')]
+    assert list(periods.iloc[0]) == [pd.Timestamp('2000-05-07')]